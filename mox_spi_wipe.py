@@ -25,7 +25,8 @@ def main():
 
     with mxt.spiflash() as flash:
         flash.reset_device()
-        flash.chip_erase()
+        polls = flash.chip_erase()
+    print("Chip erased ({} status polls)".format(polls))
 
 
 main()
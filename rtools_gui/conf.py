@@ -21,6 +21,12 @@ class Configs:
                          help="Use given config instead of default one.")
         prs.add_argument('--tmpdir', action='store',
                          help="Use given path to store temporally files.")
+        prs.add_argument('--cachedir', action='store',
+                         help="Use given path to store cached data.")
+        prs.add_argument('--transcriptdir', action='store',
+                         help="Use given path to store UART transcripts.")
+        prs.add_argument('--clear-flash-cache', action='store_true',
+                         help="Drop cached content of SPI Flash of all boards")
         self.args = prs.parse_args(argv)
         # Load configuration files
         config_file = None
@@ -61,6 +67,24 @@ class Configs:
         """Path to tmp directory"""
         return self.args.tmpdir or self._fconf('rtools', 'tmpdir') or '/tmp'
 
+    @property
+    def cache_dir(self):
+        """Path to directory with cached data"""
+        return self.args.cachedir or self._fconf('rtools', 'cachedir') or \
+            os.path.expanduser('~/.cache/rtools-gui')
+
+    @property
+    def transcript_dir(self):
+        """Path to directory with UART transcripts of runs"""
+        return self.args.transcriptdir or \
+            self._fconf('rtools', 'transcriptdir') or \
+            os.path.expanduser('~/.local/share/rtools-gui/transcripts')
+
+    @property
+    def clear_flash_cache(self):
+        """If cached content of SPI Flash should be dropped on start"""
+        return self.args.clear_flash_cache
+
     @property
     def suggest_test(self):
         """Number of failed tests before station test is suggested"""
@@ -68,6 +92,13 @@ class Configs:
             return self.config['rtools'].getint('suggesttest')
         return 3
 
+    @property
+    def spi_frequency(self):
+        """Maximal SPI clock frequency (in Hz) tried by calibration"""
+        if 'rtools' in self.config.sections() and 'spifrequency' in self.config['rtools']:
+            return self.config['rtools'].getint('spifrequency')
+        return 30000000
+
     def _db_value(self, name, default=None):
         return self._fconf('db', name) or default
 
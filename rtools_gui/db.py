@@ -140,6 +140,9 @@ class ProgrammerRun(_GenericTable):
         (%s, %s, %s, %s) RETURNING id;
         """
     _INSERT_RESULT = "INSERT INTO run_results (id, success) VALUES (%s, %s);"
+    _INSERT_TRANSCRIPT = """INSERT INTO run_transcripts
+        (id, path, rx_bytes, tx_bytes, dropped) VALUES (%s, %s, %s, %s, %s);
+        """
 
     def __init__(self, db_connection, board, programmer_state, programmer_id, steps):
         super().__init__(db_connection)
@@ -156,6 +159,12 @@ class ProgrammerRun(_GenericTable):
         self._insert(self._INSERT_RESULT, (self.id, bool(success)))
         self.finished = True
 
+    def transcript(self, path, rx_bytes, tx_bytes, dropped):
+        "Attach UART transcript to this run."
+        self._insert(
+            self._INSERT_TRANSCRIPT,
+            (self.id, path, rx_bytes, tx_bytes, dropped))
+
 
 class ProgrammerStep(_GenericTable):
     "Database reprepsentation of single step in some run"
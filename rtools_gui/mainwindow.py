@@ -1,6 +1,9 @@
 import os
 from gi.repository import GLib, Gtk
+from . import report
 from .programmer import Programmer
+from .moxtester.registry import REGISTRY
+from .moxtester.exceptions import MoxTesterException
 
 
 class MainWindow:
@@ -29,6 +32,7 @@ class MainWindow:
                              resources, i)
             prg_grid.attach(prg.widget, i % 2, i // 2, 1, 1)
             self.programmers[i] = prg
+        self._gtk_tester_monitor_register()
 
     def gtks_on_delete_event(self, *args):
         Gtk.main_quit(*args)
@@ -78,3 +82,21 @@ class MainWindow:
         self._builder.get_object('DatabaseError').set_visible(
             self.db_connection.closed)
         self._gtk_database_check_register()
+
+    def _gtk_tester_monitor_register(self):
+        GLib.timeout_add_seconds(interval=1, function=self._gtk_tester_monitor)
+
+    def _gtk_tester_monitor(self):
+        """This is periodic task that detects plugged and unplugged testers
+        and updates board presence of idle programmers.
+        """
+        connect = False
+        try:
+            if REGISTRY.changed():
+                REGISTRY.scan()
+                connect = True
+        except MoxTesterException:
+            report.ignored_exception()
+        for prg in self.programmers:
+            prg.gtk_monitor(connect)
+        self._gtk_tester_monitor_register()
@@ -0,0 +1,87 @@
+"Persistent cache of values computed from input files on startup"
+import os
+import sys
+import json
+import subprocess
+
+
+def _stat(path):
+    "Signature of file used to detect its change"
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return [stat.st_size, stat.st_mtime_ns, stat.st_ino]
+
+
+def git_inputs(path):
+    """Returns list of git metadata files of repository on given path that
+    record tags. Tags are not part of git_state but they change output of git
+    describe."""
+    gitdir = os.path.join(path, '.git')
+    if os.path.isfile(gitdir):  # Submodule or worktree
+        with open(gitdir, 'r') as file:
+            content = file.read().strip()
+        if content.startswith('gitdir:'):
+            gitdir = os.path.join(path, content[len('gitdir:'):].strip())
+    return [
+        os.path.join(gitdir, 'packed-refs'),
+        os.path.join(gitdir, 'refs', 'tags'),
+    ]
+
+
+def git_state(path):
+    """Returns state of git repository on given path as string. It contains
+    checked out commit and list of changed tracked files (of any type), so it
+    changes whenever git describe --dirty could report something else."""
+    process = subprocess.run(
+        ['git', 'status', '--porcelain=v2', '--branch',
+         '--untracked-files=no'],
+        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, cwd=path)
+    return process.stdout.decode(sys.getdefaultencoding())
+
+
+class Manifest:
+    """Values derived from set of input files stored in given JSON file.
+    Values are valid only as long as every input file has same size,
+    modification time and inode as when values were computed and parameters
+    are same. Any mismatch invalidates all values.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    @staticmethod
+    def _signature(inputs, params):
+        return {
+            'inputs': {path: _stat(path) for path in inputs},
+            'params': params,
+        }
+
+    def load(self, inputs, params):
+        """Returns dictionary with stored values or None if there are none or
+        they are no longer valid for given input files and parameters."""
+        try:
+            with open(self.path, 'r') as file:
+                manifest = json.load(file)
+        except (OSError, ValueError):
+            return None
+        if manifest.get('signature') != self._signature(inputs, params):
+            return None
+        return manifest.get('values')
+
+    def save(self, inputs, params, values):
+        """Store values computed from given input files and parameters.
+        Signature of inputs is taken now, after values were computed, as
+        computation itself can touch them (git refreshes its index). Failure
+        to store values is ignored as they are only cache."""
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path + '.tmp', 'w') as file:
+                json.dump({
+                    'signature': self._signature(inputs, params),
+                    'values': values,
+                }, file)
+            os.replace(self.path + '.tmp', self.path)
+        except OSError:
+            pass
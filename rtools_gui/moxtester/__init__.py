@@ -1,58 +1,41 @@
-import io
 import socket
-from time import sleep
-from threading import Thread, Event
+import itertools
+from collections import deque
+from time import monotonic
 from pexpect import fdpexpect
-import ftdi1 as ftdi
-from .. import report
+from .backend import ftdi
 from .spiflash import SPIFlash
+from .mpsse import SPIBurst
 from .moximager import MoxImager
+from .registry import REGISTRY
+from .reactor import REACTOR, UARTChannel
+from .capture import UARTCapture, RX, TX
 from .exceptions import MoxTesterException
-from .exceptions import MoxTesterNotFoundException
 from .exceptions import MoxTesterCommunicationException
 from .exceptions import MoxTesterInvalidMode
-from .exceptions import MoxTesterSPIException
 from .exceptions import MoxTesterSPITestFail
 
+_DEFERRED_ORDER = itertools.count()  # Order of interfaces in pin transaction
+
 
 class MoxTester:
     "Class controlling one specific mox tester."
     BOOT_MODE_SPI = 0b01
     BOOT_MODE_UART = 0b10
 
-    def __init__(self, tester_id):
+    def __init__(self, tester_id, spi_max_frequency=30000000, rescan=False):
+        """Connect to tester with given ID. Tester is looked up in process
+        wide registry and USB bus is enumerated again only if rescan is True."""
         self.tester_id = tester_id
         self.board_id = "unknown"
+        self.spi_max_frequency = spi_max_frequency
+        self.spi_frequency = None  # SPI clock selected by calibration
+        self._pins_depth = 0  # Depth of nested pin transactions
+        self.uart_capture = UARTCapture(self.board_id)
 
         self.ctx = ftdi.new()
-        ret, devs = ftdi.usb_find_all(self.ctx, 0x0403, 0x6011)
-        if ret < 0:
-            raise MoxTesterCommunicationException("Unable to list USB devices")
-        self.dev = None
-        while self.dev is None and devs is not None:
-            # Ignore any device that fails open (those are in use)
-            if ftdi.usb_open_dev(self.ctx, devs.dev) == 0:
-                if ftdi.read_eeprom(self.ctx) < 0:
-                    raise MoxTesterCommunicationException("EEPROM read failed")
-                if ftdi.eeprom_decode(self.ctx, 0) < 0:
-                    raise MoxTesterCommunicationException(
-                        'EEPROM decode failed')
-                ret, chip_tp = ftdi.get_eeprom_value(self.ctx, ftdi.CHIP_TYPE)
-                if ret < 0:
-                    raise MoxTesterCommunicationException(
-                        "Reading chip type (id) failed")
-                if chip_tp == tester_id:
-                    self.dev = devs.dev  # Setting dev if correct device found
-                if ftdi.usb_reset(self.ctx) != 0:
-                    raise MoxTesterCommunicationException(
-                        "FTDI USB device reset failed")
-                if ftdi.usb_close(self.ctx) != 0:
-                    raise MoxTesterCommunicationException(
-                        "FTDI USB device close failed")
-            devs = devs.next
-        if self.dev is None:
-            raise MoxTesterNotFoundException(
-                "There is no connected tester with id: " + str(tester_id))
+        self._lease = REGISTRY.device(tester_id, self, rescan)
+        self.dev = self._lease.dev
         self._a = None
         self._b = None
         self._c = None
@@ -76,11 +59,12 @@ class MoxTester:
                 or self._d is not None:
             raise MoxTesterException("Trying to connect to already connected tester")
         # Connect
-        self._a = _BitBangInterface(self.dev, ftdi.INTERFACE_A, 0x40)
-        self._b = _SPIInterface(self.dev, ftdi.INTERFACE_B, 0xE0)
-        self._c = _BitBangInterface(self.dev, ftdi.INTERFACE_C, 0x00)
+        self._a = _BitBangInterface(self._lease, ftdi.INTERFACE_A, 0x40)
+        self._b = _SPIInterface(self._lease, ftdi.INTERFACE_B, 0xE0)
+        self._c = _BitBangInterface(self._lease, ftdi.INTERFACE_C, 0x00)
         # TODO propagate configuration to log here
-        self._d = _UARTInterface(self.dev, ftdi.INTERFACE_D, self.board_id)
+        self._d = _UARTInterface(
+            self._lease, ftdi.INTERFACE_D, self.uart_capture)
         self.default()
 
     def reset_tester(self):
@@ -102,13 +86,25 @@ class MoxTester:
     def set_board_id(self, board_id="unknown"):
         """Set identifier for board"""
         self.board_id = board_id
-        self._d.set_board_id(board_id)
+        self.uart_capture.name = board_id
+
+    def pins(self):
+        """Returns pin transaction to be used with 'with' statement.
+        All pin changes (power, reset, boot mode, SPI outputs) done in it are
+        collected and on its end every changed interface is written in single
+        transfer. Interfaces are written in order of their first change and
+        changes on single interface are applied in order they were done.
+        Note that pins read in transaction do not reflect collected changes.
+        Transactions can be nested and changes are written by outermost one.
+        """
+        return _PinTransaction(self)
 
     def default(self):
         """Return tester state to default"""
-        self.power(False)
-        self.reset(True)
-        self.set_boot_mode(self.BOOT_MODE_SPI)
+        with self.pins():
+            self.power(False)
+            self.reset(True)
+            self.set_boot_mode(self.BOOT_MODE_SPI)
 
     def selftest(self):
         "Runs various self-test operations (such as SPI loopback test)"
@@ -172,13 +168,41 @@ class MoxTester:
         return SPIFlash(self, self._b)
 
 
+class _PinTransaction:
+    "Pin changes collected across tester interfaces (see MoxTester.pins)"
+
+    def __init__(self, moxtester):
+        self.moxtester = moxtester
+        self.interfaces = (moxtester._a, moxtester._b, moxtester._c)
+
+    def __enter__(self):
+        if self.moxtester._pins_depth == 0:
+            for interface in self.interfaces:
+                interface.defer()
+        self.moxtester._pins_depth += 1
+        return self
+
+    def __exit__(self, etype, value, traceback):
+        # Changes are written even on exception as state of interfaces was
+        # already updated.
+        self.moxtester._pins_depth -= 1
+        if self.moxtester._pins_depth == 0:
+            for interface in sorted(
+                    self.interfaces,
+                    key=lambda iface: (iface.deferred_order is None,
+                                       iface.deferred_order)):
+                interface.commit()
+
+
 class _Interface:
     "Common FTDI interface"
 
-    def __init__(self, device, interface):
+    def __init__(self, lease, interface):
+        # Own lease keeps device valid until context is deinitialized
+        self._lease = lease.share()
         self.ctx = ftdi.new()
         ftdi.set_interface(self.ctx, interface)
-        ftdi.usb_open_dev(self.ctx, device)
+        ftdi.usb_open_dev(self.ctx, lease.dev)
         if ftdi.usb_purge_buffers(self.ctx) < 0:
             raise MoxTesterCommunicationException(
                 "Buffers purge failed for port: " + str(interface))
@@ -186,13 +210,46 @@ class _Interface:
     def __del__(self):
         "Close connection to FTDI interface"
         ftdi.deinit(self.ctx)
-
-
-class _BitBangInterface(_Interface):
+        self._lease.release()
+
+
+class _PinInterface(_Interface):
+    """FTDI interface with pins that can be changed in pin transaction.
+    Subclasses write pin changes to FTDI in _write_pins method."""
+
+    def __init__(self, lease, interface):
+        super().__init__(lease, interface)
+        self._deferred = None  # Pin changes collected by pin transaction
+        self.deferred_order = None  # Order of first collected change
+
+    def _pins(self, data):
+        "Write given pin changes or collect them if transaction is open"
+        if self._deferred is None:
+            self._write_pins(data)
+            return
+        if not self._deferred:
+            self.deferred_order = next(_DEFERRED_ORDER)
+        self._deferred += data
+
+    def defer(self):
+        """Start collecting pin changes instead of writing them. Collected
+        changes are written in single transfer by commit."""
+        self._deferred = bytearray()
+        self.deferred_order = None
+
+    def commit(self):
+        "Write pin changes collected since defer and stop collecting them"
+        data = self._deferred
+        self._deferred = None
+        if data:
+            self._write_pins(data)
+
+
+class _BitBangInterface(_PinInterface):
     "FTDI interface in Bit Bang mode"
 
-    def __init__(self, device, interface, output_mask, default_value=0x00):
-        super().__init__(device, interface)
+    def __init__(self, lease, interface, output_mask, default_value=0x00):
+        super().__init__(lease, interface)
         if ftdi.set_bitmode(self.ctx, output_mask, ftdi.BITMODE_BITBANG) < 0:
             raise MoxTesterCommunicationException(
                 "Unable to set bitbang mode for port: " + str(interface))
@@ -211,7 +268,12 @@ class _BitBangInterface(_Interface):
     def gpio_set(self, data, mask=0xFF):
         "Write pins status. Whole byte at once."
         self.value = (self.value & (mask ^ 0xFF)) | (data & mask)
-        if ftdi.write_data(self.ctx, bytes([self.value])) < 0:
+        self._pins(bytes([self.value]))
+
+    def _write_pins(self, data):
+        "Write given pin changes to FTDI"
+        # Every byte is output as pins state in sequence
+        if ftdi.write_data(self.ctx, bytes(data)) < 0:
             raise MoxTesterCommunicationException("Write failed")
 
     def is_set(self, mask=0xFF):
@@ -225,38 +287,111 @@ class _BitBangInterface(_Interface):
         self.gpio_set(mask if is_set else 0x00, mask)
 
 
-class _MPSSEInterface(_Interface):
+class _PendingResponse:
+    "Response of transfers submitted to MPSSE that was not yet collected"
+
+    def __init__(self, data):
+        self.data = data  # Buffer response is read to
+        self.unread = 0  # Number of transfers with response not read yet
+
+
+class _MPSSEInterface(_PinInterface):
     "FTDI interface in MPSSE mode"
+    RX_BUFFER = 2048  # Receive buffer size of FT4232H
 
-    def __init__(self, device, interface, output_mask, default_value=0x00):
-        super().__init__(device, interface)
+    def __init__(self, lease, interface, output_mask, default_value=0x00):
+        super().__init__(lease, interface)
         self.output_mask = output_mask & 0xF0  # Mask for GPIO
         if ftdi.set_bitmode(self.ctx, 0x00, ftdi.BITMODE_MPSSE) < 0:
             raise MoxTesterCommunicationException(
                 "Unable to set MPSSE mode for port: " + str(interface))
         self.gpio_value = default_value
         self.gpio_set(self.output_mask, self.gpio_value)
+        self._responses = deque()  # Unread responses of submitted transfers
+        self._inflight = 0  # Number of bytes in unread responses
 
     def _write(self, operation):
         "Write given program to MPSSE"
-        if ftdi.write_data(self.ctx, operation) < 0:
+        if ftdi.write_data(self.ctx, bytes(operation)) < 0:
             raise MoxTesterCommunicationException("MPSSE write failed")
 
-    def _read(self):
-        "Read input buffer as bytes"
+    def _submit(self, transfers, response_size, into=None):
+        """Write given transfers without waiting for their responses. Every
+        transfer is tuple with bytes to be written and number of bytes it
+        reads. Transfer is written only if responses still in flight fit to
+        receive buffer of FTDI chip, older responses are read first otherwise.
+        That way MPSSE can execute one transfer while response of previous one
+        is read and the host never blocks on write to stalled MPSSE.
+        Returns _PendingResponse that has to be passed to _collect.
+        """
+        pending = _PendingResponse(
+            bytearray(response_size) if into is None else into)
+        view = memoryview(pending.data)
+        received = 0
+        try:
+            for operation, response in transfers:
+                while self._inflight > self.RX_BUFFER:
+                    self._receive()
+                self._write(operation)
+                if response > 0:
+                    self._responses.append(
+                        (view[received:(received + response)], pending))
+                    pending.unread = pending.unread + 1
+                    self._inflight = self._inflight + response
+                    received = received + response
+        except Exception:
+            self._responses.clear()
+            self._inflight = 0
+            raise
+        return pending
+
+    def _receive(self):
+        "Read response of the oldest submitted transfer"
+        target, pending = self._responses.popleft()
+        self._inflight = self._inflight - len(target)
+        self._read(len(target), into=target)
+        pending.unread = pending.unread - 1
+
+    def _collect(self, pending):
+        """Wait for all responses of given _PendingResponse (and all
+        responses submitted before it). Returns buffer with response."""
+        try:
+            while pending.unread > 0:
+                self._receive()
+        except Exception:
+            self._responses.clear()
+            self._inflight = 0
+            raise
+        return pending.data
+
+    def _read(self, size, timeout=5, into=None):
+        """Read input buffer. size is number of bytes that are expected to be
+        received. Read is repeated until all of them are received or timeout
+        (in seconds) elapses. Returns bytearray or, if into is provided, fills
+        given memoryview of size bytes and returns it."""
         ret, chunk_size = ftdi.read_data_get_chunksize(self.ctx)
         if ret < 0:
             raise MoxTesterCommunicationException("Get chunk size failed")
-        data = bytes()
-        while True:
-            ret, new_data = ftdi.read_data(self.ctx, chunk_size)
+        if into is None:
+            data = bytearray(size)
+            view = memoryview(data)
+        else:
+            data = into
+            view = into
+        received = 0
+        deadline = monotonic() + timeout
+        while received < size:
+            ret, new_data = ftdi.read_data(
+                self.ctx, min(size - received, chunk_size))
             if ret < 0:
                 raise MoxTesterCommunicationException("MPSSE read failed")
-            elif ret > 0:
-                data = data + new_data[0:ret]
-            else:
-                # No more data to be read so return what we have
-                return data
+            view[received:(received + ret)] = memoryview(new_data)[0:ret]
+            received = received + ret
+            if ret == 0 and monotonic() > deadline:
+                raise MoxTesterCommunicationException(
+                    "MPSSE read timeout ({} of {} bytes received)".format(
+                        received, size))
+        return data
 
     def gpio(self, mask=0xF0):
         """Read current GPIO state. You can limit pins by using mask.
@@ -270,9 +405,13 @@ class _MPSSEInterface(_Interface):
         """Write GPIO state. You can limit pins by using mask. Note that only
         four most significant bits are used."""
         self.gpio_value = (self.gpio_value & (mask ^ 0xFF)) | (value & mask)
-        self._write(bytes(
+        self._pins(bytes(
             (ftdi.SET_BITS_LOW, self.gpio_value, self.output_mask)))
 
+    def _write_pins(self, data):
+        "Write given pin changes to FTDI"
+        self._write(data)
+
     def update_output_mask(self, mask=0xF0):
         """Update mask that is used to set output pins.
         """
@@ -292,21 +431,33 @@ class _MPSSEInterface(_Interface):
 
 class _SPIInterface(_MPSSEInterface):
     "FTDI interface in MPSSE mode with SPI functionality"
+    BASE_FREQUENCY = 60000000  # MPSSE clock with divide by 5 disabled
+    DEFAULT_FREQUENCY = 6000000  # Safe SPI clock
 
-    def __init__(self, device, interface, gpio_output_mask, gpio_default=0x00):
-        super().__init__(device, interface, gpio_output_mask, gpio_default)
+    def __init__(self, lease, interface, gpio_output_mask, gpio_default=0x00):
+        super().__init__(lease, interface, gpio_output_mask, gpio_default)
         if ftdi.setflowctrl(self.ctx, ftdi.SIO_DISABLE_FLOW_CTRL) < 0:
             raise MoxTesterCommunicationException(
                 "Flow control setup failed for interface: " + str(interface))
         self.enabled = False
         self._write(bytes((
-            ftdi.EN_DIV_5,  # Enable divide by 5 of internal clock
             ftdi.DIS_3_PHASE,  # Disable 3 phase data clocking
             ftdi.DIS_ADAPTIVE,  # Disable adaprive clocking
-            ftdi.TCK_DIVISOR, 0, 0,  # Set clock to 6MHz
         )))
-        self._burst = None
-        self.spi_burst_new()
+        self.frequency = None
+        self.set_frequency(self.DEFAULT_FREQUENCY)
+
+    def set_frequency(self, frequency):
+        """Set SPI clock to the highest possible frequency that does not
+        exceed given one. Returns frequency that was set."""
+        divisor = -(-self.BASE_FREQUENCY // (2 * frequency)) - 1
+        divisor = min(max(divisor, 0), 0xFFFF)
+        self._write(bytes((
+            ftdi.DIS_DIV_5,  # Disable divide by 5 of internal clock
+            ftdi.TCK_DIVISOR, divisor & 0xFF, divisor >> 8,
+        )))
+        self.frequency = self.BASE_FREQUENCY // ((1 + divisor) * 2)
+        return self.frequency
 
     def spi_enable(self, enable):
         """Enables/Disables SPI outputs.
@@ -320,78 +471,35 @@ class _SPIInterface(_MPSSEInterface):
         self.enabled = enable
 
     def spi_burst_new(self):
-        """Drop currently lined up burst."""
-        self._burst = bytes()
-        self._spi_cs(True)
-
-    def _spi_cs(self, select):
-        self._burst = self._burst + bytes((
-            ftdi.SET_BITS_LOW,
-            (self.gpio_value & 0xF0) | (0x01 if select else 0x09),
-            self.output_mask,
-        ))
-
-    def spi_burst_cs_reset(self):
-        """Add chip select reset to current burst.
-        This unsets and sets chip select pin. This is usable when device
-        requires you to unselect it to finish single command.
+        """Returns new empty SPIBurst. Use its methods to describe operations
+        and then pass it to spi_burst to execute them.
+        Note that burst captures current GPIO state so it should be created
+        just before it is used.
         """
-        self._spi_cs(False)
-        self._spi_cs(True)
-
-    def spi_burst_read(self, size=1):
-        """Add byte read to burst. Number of bytes can be specified in size
-        argument."""
-        if size < 1 or size > (0x10000):
-            raise MoxTesterSPIException(
-                "Not supported size for single read: " + str(size))
-        self._burst = self._burst + bytes((
-            ftdi.MPSSE_DO_READ,
-            (size - 1) % 0x100,
-            (size - 1) // 0x100,
-        ))
-
-    def _spi_burst_write_common(self, size):
-        if size < 1 or size > (0x10000):
-            raise MoxTesterSPIException(
-                "Not supported size for single write: " + str(size))
-        self._burst = self._burst + bytes((
-            ftdi.MPSSE_DO_WRITE | ftdi.MPSSE_WRITE_NEG,
-            (size - 1) % 0x100,
-            (size - 1) // 0x100,
-        ))
-
-    def spi_burst_write(self, data):
-        """Write bytes.
+        return SPIBurst(self.gpio_value, self.output_mask, self.frequency)
+
+    def spi_submit(self, burst, into=None):
+        """Start given burst without waiting for its response. Returned object
+        has to be passed to spi_collect to receive response. It is possible
+        to submit other bursts in meantime so MPSSE does not have to wait for
+        host to prepare them.
+        into can be writable buffer (such as memoryview) where read bytes are
+        stored. It has to have size of burst response.
         """
-        self._spi_burst_write_common(len(data))
-        self._burst = self._burst + data
-
-    def spi_burst_write_int(self, value, size=1, bigendian=True):
-        """Write integer as a type of given size in bytes.
+        return self._submit(burst.transfers(), burst.response_size, into)
+
+    def spi_collect(self, pending):
+        """Wait for burst submitted by spi_submit and return bytearray with
+        all read bytes (or buffer passed to spi_submit as into)."""
+        return self._collect(pending)
+
+    def spi_burst(self, burst, into=None):
+        """Run given burst and return bytearray with all read bytes.
+        into can be writable buffer (such as memoryview) where read bytes are
+        stored instead. It has to have size of burst response. It is returned
+        in such case.
         """
-        self._spi_burst_write_common(size)
-        self._burst = self._burst + value.to_bytes(
-            size, 'big' if bigendian else 'little')
-
-    def spi_burst(self):
-        """Run prepared burst and return read result.
-        Use spi_burst_* methods to add operations to single burst.
-        """
-        self._spi_cs(False)
-        self._write(self._burst)
-        data = self._read()
-        self.spi_burst_new()
-        return data
-
-    def spi_burst_int(self):
-        """Run prepared burst and return read result as a single integer
-        number. Use spi_burst_* methods to add operations to single burst.
-        """
-        value = self.spi_burst()
-        if value is not None:
-            return int.from_bytes(value, 'big')
-        return value
+        return self.spi_collect(self.spi_submit(burst, into))
 
     def spi_loopback(self, enable):
         "Set SPI loopback. Note that this automaticaly disabled SPI output."
@@ -409,26 +517,26 @@ class _SPIInterface(_MPSSEInterface):
         self.spi_loopback(True)
         ftdi.usb_purge_buffers(self.ctx)
         self._write(bytes((0xAB,)))
-        read = int.from_bytes(self._read(), 'big')
+        read = int.from_bytes(self._read(2), 'big')
         if read != 0xFAAB:
             raise MoxTesterSPITestFail("Invalid respond on bogus command " + "(expected 0xfaab but received {})".format(hex(read)))
         self._write(bytes((
             ftdi.MPSSE_DO_READ | ftdi.MPSSE_DO_WRITE | ftdi.MPSSE_READ_NEG,
             0, 0, 0x42,
         )))
-        data = int.from_bytes(self._read(), 'big')
+        data = int.from_bytes(self._read(1), 'big')
         if data != 0x42:
             raise MoxTesterSPITestFail("Invalid value read on loopkback " + "(expected 0x42 but received {})".format(hex(data)))
         self.spi_loopback(False)
 
 
 class _UARTInterface(_Interface):
-    "FTDI interface in Bit Bang mode"
+    "FTDI interface in UART mode"
+    LATENCY = 2  # Latency timer (ms), it limits how long empty read blocks
 
-    def __init__(self, device, interface, board_id="unknown", log=True):
-        super().__init__(device, interface)
-        self.board_id = board_id
-        self.log = log
+    def __init__(self, lease, interface, capture):
+        super().__init__(lease, interface)
+        self.capture = capture
         if ftdi.set_bitmode(self.ctx, 0x00, ftdi.BITMODE_RESET) < 0:
             raise MoxTesterCommunicationException(
                 "Unable to reset bitmode for port: " + str(interface))
@@ -439,68 +547,30 @@ class _UARTInterface(_Interface):
                 self.ctx, ftdi.BITS_8, ftdi.STOP_BIT_1, ftdi.NONE):
             raise MoxTesterCommunicationException(
                 "Line property setup failed for interface: " + str(interface))
+        if ftdi.set_event_char(self.ctx, ord('\n'), 1) < 0:
+            raise MoxTesterCommunicationException(
+                "Event character setup failed for interface: " + str(interface))
+        if ftdi.set_latency_timer(self.ctx, self.LATENCY) < 0:
+            raise MoxTesterCommunicationException(
+                "Latency timer setup failed for interface: " + str(interface))
 
-        # Input
-        self.inputthreadexit = Event()
-        # TODO add sensible name
-        self.inputthread = Thread(
-            target=self._input, daemon=True)
-        self.inputthread.start()  # Start input immediately
-        # Output
         self.socks = socket.socketpair()
-        self.outputthreadexit = Event()
-        # TODO add sensible name
-        self.outputthread = Thread(target=self._output, daemon=True)
-        self.outputthread.start()
+        self.channel = UARTChannel(
+            self.ctx, self.socks[0],
+            lambda data: capture.record(RX, data),
+            lambda data: capture.record(TX, data))
+        REACTOR.add(self.channel)
 
     def __del__(self):
-        self.inputthreadexit.set()
-        self.outputthreadexit.set()
+        if self.socks is None:
+            return  # Already closed
+        REACTOR.remove(self.channel)
         self.socks[1].close()
         toclose = self.socks[0]
         self.socks = None
         toclose.close()
-        self.inputthread.join()
-        self.outputthread.join()
         super().__del__()
 
-    def set_board_id(self, board_id="unknown"):
-        self.board_id = board_id
-
-    def _chunk_size(self):
-        ret, chunk_size = ftdi.read_data_get_chunksize(self.ctx)
-        if ret < 0:
-            raise MoxTesterCommunicationException("UART get chunk size failed")
-        return chunk_size
-
-    def _input(self):
-        chunk_size = self._chunk_size()
-        prev_data = b''
-        while not self.inputthreadexit.is_set():
-            ret, data = ftdi.read_data(self.ctx, chunk_size)
-            if ret < 0:
-                raise MoxTesterCommunicationException("UART Read failed")
-            elif ret > 0:
-                self.socks[0].sendall(data[0:ret])
-                new_data = data[0:ret]
-                index = new_data.find(b'\n')
-                if index >= 0:
-                    report.log('UART({}): '.format(self.board_id) + str(prev_data + new_data[0:index + 1]))
-                    prev_data = new_data[index:]
-                else:
-                    prev_data = prev_data + new_data
-            else:
-                # Sleep for short amount of time to not busyloop
-                sleep(0.01)
-
-    def _output(self):
-        chunk_size = self._chunk_size()
-        while not self.outputthreadexit.is_set():
-            data = self.socks[0].recv(chunk_size)
-            # TODO do we want to log this also?
-            if ftdi.write_data(self.ctx, data) < 0:
-                raise MoxTesterCommunicationException("UART Write failed")
-
     def fileno(self):
         "Create new file descriptior (while closing the old one) and return it"
         return self.socks[1].fileno()
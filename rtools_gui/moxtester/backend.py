@@ -0,0 +1,28 @@
+"""FTDI library used by MoxTester. Real libftdi1 bindings are used unless
+RTOOLS_FTDI_EMULATOR environment variable is set to non-empty value. In such
+case emulated testers are used instead.
+usb_location(dev) returns tuple with USB bus number and device address of
+libusb device as listed by ftdi.usb_find_all. libftdi1 does not provide it so
+it is taken from libusb directly."""
+import os
+
+if os.environ.get('RTOOLS_FTDI_EMULATOR'):
+    from . import emulator as ftdi
+    from .emulator import usb_location
+else:
+    import ctypes
+    import ctypes.util
+    import ftdi1 as ftdi
+
+    _LIBUSB = ctypes.CDLL(
+        ctypes.util.find_library('usb-1.0') or 'libusb-1.0.so.0')
+    for _function in (_LIBUSB.libusb_get_bus_number,
+                      _LIBUSB.libusb_get_device_address):
+        _function.argtypes = (ctypes.c_void_p,)
+        _function.restype = ctypes.c_uint8
+
+    def usb_location(dev):
+        "Returns tuple with bus number and address of given libusb device"
+        pointer = ctypes.c_void_p(int(dev))  # SWIG pointer to libusb_device
+        return (_LIBUSB.libusb_get_bus_number(pointer),
+                _LIBUSB.libusb_get_device_address(pointer))
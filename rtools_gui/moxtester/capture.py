@@ -0,0 +1,115 @@
+"Capture of UART communication with board"
+import os
+import gzip
+from time import monotonic
+from collections import deque
+from threading import Thread, Event, Lock
+from .. import report
+
+RX = 'rx'  # Data received from board
+TX = 'tx'  # Data sent to board
+
+
+class UARTCapture:
+    """Fixed size ring buffer of timestamped UART data of one tester.
+    Recording is cheap and never blocks so it can be called from UART reactor.
+    While transcript is open, records are written to it (gzip compressed) in
+    batches by background thread. Records overwritten before they were written
+    are counted as dropped.
+    """
+    SIZE = 4096  # Number of records (chunks of data) kept in ring buffer
+    FLUSH_PERIOD = 1  # Seconds between writes to transcript
+    SUMMARY_LIMIT = 200  # Maximal length of last line reported to syslog
+
+    def __init__(self, name):
+        self.name = name
+        self._records = deque(maxlen=self.SIZE)
+        self._seq = 0  # Sequence number of next record
+        self._lock = Lock()  # Guards transcript
+        self._file = None
+        self._start = None
+        self._flushed = 0  # Sequence number of next record to be written
+        self._last_line = b''  # Last line received (for summary)
+        self._line_ended = False  # If newline was received after last line
+        self._thread = None
+        self._stop = Event()
+        self.stats = None
+
+    def record(self, direction, data):
+        "Record given data transferred in given direction (RX or TX)"
+        # Sequence number is assigned by single reactor thread and appending
+        # to deque is thread safe.
+        self._records.append((self._seq, monotonic(), direction, data))
+        self._seq += 1
+
+    def start(self, path):
+        """Start writing records to transcript file on given path. Only
+        records from this moment are written."""
+        self.stop()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._lock:
+            self._file = gzip.open(path, 'wt', encoding='ascii')
+            self._start = monotonic()
+            self._flushed = self._seq
+            self.stats = {RX: 0, TX: 0, 'dropped': 0}
+            self._last_line = b''
+            self._line_ended = False
+        self._stop.clear()
+        self._thread = Thread(
+            target=self._run, name="uart-capture-" + str(self.name),
+            daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Write remaining records, close transcript and report summary of it
+        to syslog. Returns dictionary with statistics or None if there was no
+        transcript open."""
+        if self._thread is None:
+            return None
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        with self._lock:
+            self._flush()
+            self._file.close()
+            self._file = None
+        report.log('UART({}): {} bytes received, {} sent, {} chunks dropped, last line: {}'.format(
+            self.name, self.stats[RX], self.stats[TX], self.stats['dropped'],
+            repr(self._last_line[-self.SUMMARY_LIMIT:])))
+        return self.stats
+
+    def _run(self):
+        while not self._stop.wait(self.FLUSH_PERIOD):
+            with self._lock:
+                self._flush()
+
+    def _flush(self):
+        "Write records not yet written to transcript"
+        # Copy of deque is done in single step so it is safe to do it while
+        # reactor appends to it.
+        records = [
+            record for record in list(self._records)
+            if record[0] >= self._flushed]
+        if not records:
+            return
+        self.stats['dropped'] += records[0][0] - self._flushed
+        self._flushed = records[-1][0] + 1
+        lines = []
+        for _, timestamp, direction, data in records:
+            self.stats[direction] += len(data)
+            lines.append('{:.6f} {} {}\n'.format(
+                timestamp - self._start, direction, repr(data)[2:-1]))
+            if direction == RX:
+                self._record_line(data)
+        self._file.write(''.join(lines))
+
+    def _record_line(self, data):
+        "Update last line with given received data"
+        text = data.rstrip(b'\r\n')
+        if text:
+            if self._line_ended:
+                self._last_line = b''
+            self._last_line = (self._last_line + text).rsplit(
+                b'\n', 1)[-1][-self.SUMMARY_LIMIT:]
+        if data:
+            self._line_ended = data.endswith((b'\r', b'\n'))
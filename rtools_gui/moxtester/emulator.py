@@ -0,0 +1,544 @@
+"""Emulated libftdi1 backend.
+
+This module implements subset of ftdi1 python bindings API that is used by
+MoxTester. It emulates four Mox testers (FT4232H) with bit bang GPIO, MPSSE
+with connected SPI NOR flash and UART interfaces. It is used instead of ftdi1
+when RTOOLS_FTDI_EMULATOR environment variable is set (see backend module).
+
+Emulation can be tuned by following environment variables:
+RTOOLS_FTDI_EMULATOR_SCALE: multiplier of SPI Flash program and erase times
+RTOOLS_FTDI_EMULATOR_MAX_SPI: SPI clock (in Hz) above which reads are
+    occasionally corrupted
+"""
+import os
+import random
+import time
+import itertools
+import collections
+import threading
+
+# Interfaces
+INTERFACE_ANY = 0
+INTERFACE_A = 1
+INTERFACE_B = 2
+INTERFACE_C = 3
+INTERFACE_D = 4
+# Bit modes
+BITMODE_RESET = 0x00
+BITMODE_BITBANG = 0x01
+BITMODE_MPSSE = 0x02
+# MPSSE shifting commands
+MPSSE_WRITE_NEG = 0x01
+MPSSE_BITMODE = 0x02
+MPSSE_READ_NEG = 0x04
+MPSSE_LSB = 0x08
+MPSSE_DO_WRITE = 0x10
+MPSSE_DO_READ = 0x20
+MPSSE_WRITE_TMS = 0x40
+# MPSSE other commands
+SET_BITS_LOW = 0x80
+SET_BITS_HIGH = 0x82
+GET_BITS_LOW = 0x81
+GET_BITS_HIGH = 0x83
+LOOPBACK_START = 0x84
+LOOPBACK_END = 0x85
+TCK_DIVISOR = 0x86
+SEND_IMMEDIATE = 0x87
+DIS_DIV_5 = 0x8a
+EN_DIV_5 = 0x8b
+EN_3_PHASE = 0x8c
+DIS_3_PHASE = 0x8d
+CLK_BITS = 0x8e
+CLK_BYTES = 0x8f
+CLK_WAIT_HIGH = 0x94
+CLK_WAIT_LOW = 0x95
+EN_ADAPTIVE = 0x96
+DIS_ADAPTIVE = 0x97
+# Flow control and line properties
+SIO_DISABLE_FLOW_CTRL = 0x0
+BITS_7 = 7
+BITS_8 = 8
+STOP_BIT_1 = 0
+NONE = 0
+# EEPROM values
+CHIP_TYPE = 12
+
+_TX_BUFFER = 2048
+_LATENCY = 16
+_ADDRESSES = itertools.count(2)  # USB addresses of emulated devices
+_MAX_SPI = float(os.environ.get('RTOOLS_FTDI_EMULATOR_MAX_SPI', '1e9'))
+
+
+class _Flash:
+    "Emulated Winbond W25Q64JV SPI NOR flash"
+    SIZE = 0x800000
+    JEDEC = bytes((0xEF, 0x40, 0x17))
+
+    def __init__(self, scale=1.0):
+        self.data = bytearray(b'\xff' * self.SIZE)
+        self.unique_id = os.urandom(8)
+        self.scale = scale
+        self.busy_until = 0
+        self.wel = False
+        self.cmd = None
+        self.buf = bytearray()
+        self.out = None
+
+    def busy(self, now):
+        "If flash is busy in given device time"
+        return now < self.busy_until
+
+    def select(self):
+        "Chip select asserted"
+        self.cmd = None
+        self.buf = bytearray()
+        self.out = None
+
+    def _output(self, now):
+        cmd = self.cmd
+        if cmd == 0x05:
+            while True:
+                yield (0x01 if self.busy(now()) else 0x00) | \
+                    (0x02 if self.wel else 0x00)
+        if self.busy(now()):
+            return
+        if cmd in (0x35, 0x15):
+            while True:
+                yield 0x00
+        elif cmd == 0x9F:
+            yield from self.JEDEC
+        elif cmd in (0x03, 0x0B):
+            address = int.from_bytes(self.buf[1:4], 'big')
+            while True:
+                yield self.data[address % self.SIZE]
+                address += 1
+        elif cmd == 0x4B:
+            yield from self.unique_id
+        elif cmd == 0x5A:
+            address = int.from_bytes(self.buf[1:4], 'big')
+            table = _sfdp()
+            while True:
+                yield table[address] if address < len(table) else 0xFF
+                address += 1
+
+    def _output_start(self):
+        "Number of bytes before output starts for current command"
+        return {0x03: 4, 0x0B: 5, 0x4B: 5, 0x5A: 5}.get(self.cmd, 1)
+
+    def transfer(self, byte, now):
+        "Transfer single byte and return output byte"
+        if self.cmd is None:
+            self.cmd = byte
+        if len(self.buf) < 4 + 256:
+            self.buf.append(byte)
+        if len(self.buf) <= self._output_start():
+            return 0xFF
+        if self.out is None:
+            self.out = self._output(now)
+        return next(self.out, 0xFF)
+
+    def deselect(self, now):
+        "Chip select released, execute command if it is write command"
+        cmd = self.cmd
+        self.cmd = None
+        if cmd is None or self.busy(now):
+            return
+        if cmd == 0x06:
+            self.wel = True
+        elif cmd == 0x04:
+            self.wel = False
+        elif cmd in (0x02, 0x20, 0x52, 0xD8, 0x60, 0xC7) and self.wel:
+            self.wel = False
+            address = int.from_bytes(self.buf[1:4], 'big')
+            if cmd == 0x02:
+                page = address & ~0xFF
+                for i, byte in enumerate(self.buf[4:]):
+                    offset = page + ((address + i) & 0xFF)
+                    self.data[offset] &= byte
+                duration = 0.0007
+            else:
+                size, duration = {
+                    0x20: (0x1000, 0.045),
+                    0x52: (0x8000, 0.12),
+                    0xD8: (0x10000, 0.15),
+                    0x60: (self.SIZE, 20),
+                    0xC7: (self.SIZE, 20),
+                }[cmd]
+                start = address & ~(size - 1)
+                self.data[start:start + size] = b'\xff' * size
+            self.busy_until = now + duration * self.scale
+
+
+def _sfdp():
+    "SFDP table of W25Q64JV"
+    table = bytearray(b'\xff' * 0x100)
+    table[0:16] = bytes((
+        0x53, 0x46, 0x44, 0x50, 0x05, 0x01, 0x00, 0xFF,
+        0x00, 0x05, 0x01, 0x10, 0x80, 0x00, 0x00, 0xFF))
+    dwords = (
+        0xFFF920E5, 0x03FFFFFF, 0x6B08EB44, 0xBB423B08, 0xFFFFFFFE,
+        0xFF00FFFF, 0xEB40FFFF, 0x520F200C, 0xFF00D810, 0x00A60245,
+        0x33F42B8A, 0xD0E26C90, 0x3A5C1B45, 0xFF1D6A72, 0xFF1D6A72,
+        0x00000000)
+    for i, dword in enumerate(dwords):
+        table[0x80 + 4 * i:0x84 + 4 * i] = dword.to_bytes(4, 'little')
+    return table
+
+
+class _Interface:
+    "Generic emulated FTDI interface"
+
+    def __init__(self, device, index):
+        self.device = device
+        self.index = index
+        self.mode = BITMODE_RESET
+        self.direction = 0x00
+        self.value = 0x00
+        self.rx = collections.deque()  # (ready_time, bytes)
+        self.latency = _LATENCY
+        self.event_char = None
+        self.writes = 0
+        self.reads = 0
+        self.tx_bytes = 0
+        self.rx_bytes = 0
+
+    def pins(self):
+        "Current pins state"
+        return (self.value & self.direction) | \
+            (self.device.inputs(self.index) & ~self.direction & 0xFF)
+
+    def write(self, data):
+        "Write data to interface"
+        self.writes += 1
+        self.tx_bytes += len(data)
+        if self.mode == BITMODE_BITBANG:
+            if data:
+                self.value = data[-1]
+        elif self.mode == BITMODE_MPSSE:
+            self.device.mpsse(self, bytes(data))
+        else:
+            self.device.uart_write(self, bytes(data))
+        return len(data)
+
+    def read(self, size):
+        "Read up to size bytes of data that MPSSE already clocked in"
+        self.reads += 1
+        if self.mode == BITMODE_RESET:
+            self.device.uart_poll(self)
+        deadline = time.monotonic() + self.latency / 1000
+        data = bytearray()
+        while not data:
+            now = time.monotonic()
+            while self.rx and len(data) < size:
+                start, end, chunk = self.rx[0]
+                if now >= end:
+                    ready = len(chunk)
+                elif now <= start:
+                    ready = 0
+                else:
+                    ready = int(len(chunk) * (now - start) / (end - start))
+                ready = min(ready, size - len(data))
+                if ready <= 0:
+                    break
+                data += chunk[:ready]
+                if ready == len(chunk):
+                    self.rx.popleft()
+                else:
+                    start = start + (end - start) * ready / len(chunk)
+                    self.rx[0] = (start, end, chunk[ready:])
+            if data or now >= deadline:
+                break
+            time.sleep(0.001)
+        self.rx_bytes += len(data)
+        return bytes(data)
+
+
+class _Device:
+    "Emulated Mox tester"
+
+    def __init__(self, chip_type, scale=1.0):
+        self.chip_type = chip_type
+        self.flash = _Flash(scale)
+        self.board_present = True
+        self.interfaces = {i: _Interface(self, i) for i in range(1, 5)}
+        self.claimed = set()  # Interfaces opened by some context
+        self.resets = 0  # Number of USB resets
+        self.address = next(_ADDRESSES)  # USB address (new for every device)
+        self.lock = threading.Lock()
+        # MPSSE state
+        self.time = 0
+        self.frequency = 6000000
+        self.div5 = True
+        self.divisor = 0
+        self.loopback = False
+        self.pending = collections.deque()  # (cumulative bytes, start time)
+        self.written = 0
+        self.uart_rx = bytearray()
+
+    def inputs(self, index):
+        "Input pins for given interface"
+        if index == INTERFACE_A:
+            return 0x00 if self.board_present else 0x80
+        return 0x00
+
+    def _clock(self):
+        base = 12000000 if self.div5 else 60000000
+        self.frequency = base / ((1 + self.divisor) * 2)
+
+    def _shift(self, iface, data=None, size=0, read=False):
+        selected = not (iface.value & 0x08)
+        out = bytearray()
+        for i in range(len(data) if data is not None else size):
+            byte = data[i] if data is not None else 0xFF
+            if self.loopback:
+                res = byte
+            elif selected and iface.direction & 0x08:
+                res = self.flash.transfer(byte, lambda: self.time)
+            else:
+                res = 0xFF
+            if read:
+                if self.frequency > _MAX_SPI and random.random() < 0.01:
+                    res ^= 0x10
+                out.append(res)
+            self.time += 8 / self.frequency
+        return out
+
+    def _set_low(self, iface, value, direction):
+        was_selected = not (iface.value & 0x08) and iface.direction & 0x08
+        iface.value = value
+        iface.direction = direction
+        selected = not (iface.value & 0x08) and iface.direction & 0x08
+        if selected and not was_selected:
+            self.flash.select()
+        elif was_selected and not selected:
+            self.flash.deselect(self.time)
+
+    def mpsse(self, iface, data):
+        "Execute MPSSE commands"
+        with self.lock:
+            now = time.monotonic()
+            self.time = max(self.time, now)
+            i = 0
+            while i < len(data):
+                self.pending.append((self.written + i, self.time))
+                cmd = data[i]
+                if cmd & 0x80 == 0:
+                    length = data[i + 1] + (data[i + 2] << 8) + 1
+                    i += 3
+                    wdata = None
+                    if cmd & MPSSE_DO_WRITE:
+                        wdata = data[i:i + length]
+                        i += length
+                    start = self.time
+                    out = self._shift(iface, wdata, length, bool(cmd & MPSSE_DO_READ))
+                    if out:
+                        iface.rx.append((start, self.time, bytes(out)))
+                elif cmd == SET_BITS_LOW:
+                    self._set_low(iface, data[i + 1], data[i + 2])
+                    i += 3
+                elif cmd == GET_BITS_LOW:
+                    iface.rx.append((self.time, self.time, bytes((iface.pins(),))))
+                    i += 1
+                elif cmd in (SET_BITS_HIGH,):
+                    i += 3
+                elif cmd == TCK_DIVISOR:
+                    self.divisor = data[i + 1] + (data[i + 2] << 8)
+                    self._clock()
+                    i += 3
+                elif cmd in (EN_DIV_5, DIS_DIV_5):
+                    self.div5 = cmd == EN_DIV_5
+                    self._clock()
+                    i += 1
+                elif cmd in (LOOPBACK_START, LOOPBACK_END):
+                    self.loopback = cmd == LOOPBACK_START
+                    i += 1
+                elif cmd == CLK_BYTES:
+                    length = data[i + 1] + (data[i + 2] << 8) + 1
+                    self.time += 8 * length / self.frequency
+                    i += 3
+                elif cmd == CLK_BITS:
+                    self.time += (data[i + 1] + 1) / self.frequency
+                    i += 2
+                elif cmd in (DIS_3_PHASE, EN_3_PHASE, DIS_ADAPTIVE,
+                             EN_ADAPTIVE, SEND_IMMEDIATE):
+                    i += 1
+                else:
+                    iface.rx.append((self.time, self.time, bytes((0xFA, cmd))))
+                    i += 1
+            self.written += len(data)
+            # Block while more than TX buffer is waiting for execution
+            limit = self.written - _TX_BUFFER
+            wait_until = now
+            while self.pending and self.pending[0][0] < limit:
+                wait_until = self.pending.popleft()[1]
+            while len(self.pending) > 1 and self.pending[1][1] <= now:
+                self.pending.popleft()
+        if wait_until > now:
+            time.sleep(wait_until - now)
+
+    def uart_write(self, iface, data):
+        "Data written to UART are echoed back"
+        iface.rx.append((time.monotonic(), time.monotonic(), data))
+
+    def uart_poll(self, iface):
+        "Nothing to do, UART is echo only"
+
+
+class _DeviceList:
+    "Linked list of devices as returned by usb_find_all"
+
+    def __init__(self, dev, next_item):
+        self.dev = dev
+        self.next = next_item
+
+
+class _Context:
+    "Emulated ftdi_context"
+
+    def __init__(self):
+        self.interface = INTERFACE_A
+        self.device = None
+        self.iface = None
+        self.chunksize = 4096
+        self.usb_read_timeout = 5000
+        self.usb_write_timeout = 5000
+
+
+DEVICES = [
+    _Device(i, float(os.environ.get('RTOOLS_FTDI_EMULATOR_SCALE', '1')))
+    for i in range(4)]
+
+
+def new():
+    return _Context()
+
+
+def _release(ctx):
+    if ctx.device is not None:
+        ctx.device.claimed.discard(ctx.iface.index)
+    ctx.device = None
+    ctx.iface = None
+
+
+def deinit(ctx):
+    _release(ctx)
+
+
+free = deinit
+
+
+def set_interface(ctx, interface):
+    ctx.interface = interface
+    return 0
+
+
+def usb_find_all(ctx, vendor, product):
+    devs = None
+    for dev in reversed(DEVICES):
+        devs = _DeviceList(dev, devs)
+    return len(DEVICES), devs
+
+
+def list_free(devs):
+    pass
+
+
+def usb_location(dev):
+    "Returns tuple with USB bus number and address of given device"
+    return 1, dev.address
+
+
+def usb_open_dev(ctx, dev):
+    interface = ctx.interface or INTERFACE_A
+    if interface in dev.claimed:
+        return -5  # Unable to claim device (it is in use)
+    dev.claimed.add(interface)
+    ctx.device = dev
+    ctx.iface = dev.interfaces[interface]
+    return 0
+
+
+def usb_close(ctx):
+    _release(ctx)
+    return 0
+
+
+def usb_reset(ctx):
+    ctx.device.resets += 1
+    return 0
+
+
+def usb_purge_buffers(ctx):
+    ctx.iface.rx.clear()
+    return 0
+
+
+def read_eeprom(ctx):
+    return 0
+
+
+def eeprom_decode(ctx, verbose):
+    return 0
+
+
+def get_eeprom_value(ctx, name):
+    if name == CHIP_TYPE:
+        return 0, ctx.device.chip_type
+    return -1, 0
+
+
+def set_bitmode(ctx, mask, mode):
+    ctx.iface.mode = mode
+    if mode == BITMODE_BITBANG:
+        ctx.iface.direction = mask
+    return 0
+
+
+def setflowctrl(ctx, flowctrl):
+    return 0
+
+
+def set_baudrate(ctx, baudrate):
+    return 0
+
+
+def set_line_property(ctx, bits, sbit, parity):
+    return 0
+
+
+def set_latency_timer(ctx, latency):
+    if latency < 1 or latency > 255:
+        return -1
+    ctx.iface.latency = latency
+    return 0
+
+
+def get_latency_timer(ctx):
+    return 0, ctx.iface.latency
+
+
+def set_event_char(ctx, eventch, enable):
+    ctx.iface.event_char = eventch if enable else None
+    return 0
+
+
+def read_data_get_chunksize(ctx):
+    return 0, ctx.chunksize
+
+
+def read_data_set_chunksize(ctx, chunksize):
+    ctx.chunksize = chunksize
+    return 0
+
+
+def read_pins(ctx):
+    return 0, bytes((ctx.iface.pins(),))
+
+
+def write_data(ctx, data):
+    return ctx.iface.write(data)
+
+
+def read_data(ctx, size):
+    data = ctx.iface.read(size)
+    return len(data), data
@@ -36,6 +36,11 @@ class MoxTesterSPIFLashUnalignedException(MoxTesterSPIException):
     pass
 
 
+class MoxTesterSPIFlashTimeoutException(MoxTesterSPIException):
+    """SPI Flash was busy for longer than it should be."""
+    pass
+
+
 class MoxTesterImagerNoBootPrompt(MoxTesterException):
     """There was no boot prompt. This might mean that CPU is already locked"""
     pass
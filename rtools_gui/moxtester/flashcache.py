@@ -0,0 +1,90 @@
+"Cache of SPI Flash content of boards programmed on this station"
+import os
+import json
+import hashlib
+from threading import Lock
+
+
+def sector_digests(address, data, sector_size):
+    """Returns dictionary with address of sector as key and SHA256 digest (in
+    hex) of part of data in that sector as value. address has to be aligned to
+    sector_size."""
+    return {
+        address + offset:
+        hashlib.sha256(data[offset:(offset + sector_size)]).hexdigest()
+        for offset in range(0, len(data), sector_size)
+    }
+
+
+class FlashCache:
+    """Cache of per-sector digests of SPI Flash content. Entries are keyed by
+    unique ID of SPI Flash chip and stored as files in given directory. Only
+    limit of most recently used entries is kept.
+    """
+
+    def __init__(self, directory, limit=1000):
+        self.directory = directory
+        self.limit = limit
+        self._lock = Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, unique_id):
+        return os.path.join(self.directory, unique_id.hex() + '.json')
+
+    def lookup(self, unique_id, sector_size):
+        """Returns dictionary with sector digests (see sector_digests) recorded
+        for chip with given unique ID. Empty dictionary is returned if there is
+        no such record or it was recorded with different sector size."""
+        path = self._path(unique_id)
+        with self._lock:
+            try:
+                with open(path, 'r') as file:
+                    entry = json.load(file)
+                os.utime(path)  # Mark as recently used
+            except (OSError, ValueError):
+                return dict()
+        if entry.get('sector_size') != sector_size:
+            return dict()
+        return {int(addr): digest for addr, digest in entry['sectors'].items()}
+
+    def update(self, unique_id, sector_size, digests):
+        """Record sector digests for chip with given unique ID. Previous record
+        is replaced."""
+        path = self._path(unique_id)
+        with self._lock:
+            with open(path + '.tmp', 'w') as file:
+                json.dump({
+                    'sector_size': sector_size,
+                    'sectors': {
+                        str(addr): digest for addr, digest in digests.items()},
+                }, file)
+            os.replace(path + '.tmp', path)
+            self._evict()
+
+    def invalidate(self, unique_id):
+        "Drop record for chip with given unique ID"
+        with self._lock:
+            try:
+                os.remove(self._path(unique_id))
+            except FileNotFoundError:
+                pass
+
+    def clear(self):
+        "Drop all records"
+        with self._lock:
+            for path in self._entries():
+                os.remove(path)
+
+    def _entries(self):
+        return [
+            os.path.join(self.directory, name)
+            for name in os.listdir(self.directory) if name.endswith('.json')]
+
+    def _evict(self):
+        "Remove least recently used entries over limit"
+        entries = self._entries()
+        if len(entries) <= self.limit:
+            return
+        entries.sort(key=os.path.getmtime)
+        for path in entries[:(len(entries) - self.limit)]:
+            os.remove(path)
@@ -0,0 +1,127 @@
+"Database of SPI Flash chips with their geometry and timing"
+
+SECTOR_ERASE = 0x20
+BLOCK_ERASE_32K = 0x52
+BLOCK_ERASE_64K = 0xD8
+
+
+class FlashChip:
+    """Description of SPI Flash chip. All times are tuples with typical and
+    maximal time in seconds.
+    name: human readable name of chip
+    size: size of chip in bytes (None if not known)
+    page_size: size of page in bytes
+    erases: dictionary with erase size in bytes as key and tuple with opcode
+        and times of erase as value. Smallest erase size is sector size.
+    page_program: times of page program
+    chip_erase: times of chip erase
+    read_frequency: maximal SPI clock in Hz for Read Data command. Fast Read
+        command is used with faster clock.
+    """
+
+    def __init__(self, name, size, page_size, erases, page_program,
+                 chip_erase, read_frequency):
+        self.name = name
+        self.size = size
+        self.page_size = page_size
+        self.erases = erases
+        self.page_program = page_program
+        self.chip_erase = chip_erase
+        self.read_frequency = read_frequency
+
+    @property
+    def sector_size(self):
+        "Size of smallest erasable sector"
+        return min(self.erases)
+
+
+# Chip used when chip is not known and it has no valid SFDP. These are worst
+# case values of chips used so far.
+GENERIC = FlashChip(
+    "generic", None, 256, {
+        0x1000: (SECTOR_ERASE, (0.045, 0.4)),
+        0x8000: (BLOCK_ERASE_32K, (0.12, 1.6)),
+        0x10000: (BLOCK_ERASE_64K, (0.15, 2)),
+    }, (0.0007, 0.005), (20, 100), 33000000)
+
+# Known chips. Key is JEDEC ID (manufacturer, memory type and capacity).
+CHIPS = {
+    0xEF4017: FlashChip(
+        "Winbond W25Q64FV/JV", 0x800000, 256, {
+            0x1000: (SECTOR_ERASE, (0.045, 0.4)),
+            0x8000: (BLOCK_ERASE_32K, (0.12, 1.6)),
+            0x10000: (BLOCK_ERASE_64K, (0.15, 2)),
+        }, (0.0007, 0.003), (20, 100), 50000000),
+    0xEF4018: FlashChip(
+        "Winbond W25Q128FV/JV", 0x1000000, 256, {
+            0x1000: (SECTOR_ERASE, (0.045, 0.4)),
+            0x8000: (BLOCK_ERASE_32K, (0.12, 1.6)),
+            0x10000: (BLOCK_ERASE_64K, (0.15, 2)),
+        }, (0.0007, 0.003), (40, 200), 50000000),
+}
+
+
+def _time(count, unit, multiplier):
+    "Typical and maximal time from SFDP count, unit and maximum multiplier"
+    typical = (count + 1) * unit
+    return typical, typical * multiplier
+
+
+def from_sfdp(name, table):
+    """Create FlashChip from JEDEC Basic Flash Parameter Table as defined by
+    JESD216. table is bytes of table as read from SFDP. Returns None if table
+    is too short to describe chip. Values not described by table are taken
+    from GENERIC."""
+    if table is None or len(table) < 9 * 4:
+        return None
+    dwords = [
+        int.from_bytes(table[i:(i + 4)], 'little')
+        for i in range(0, len(table) - 3, 4)]
+    density = dwords[1]
+    if density & 0x80000000:
+        size = (1 << (density & 0x7FFFFFFF)) // 8
+    else:
+        size = (density + 1) // 8
+    erase_times = [None] * 4
+    page_size = GENERIC.page_size
+    page_program = GENERIC.page_program
+    chip_erase = GENERIC.chip_erase
+    if len(dwords) >= 11:
+        multiplier = 2 * ((dwords[9] & 0xF) + 1)
+        for i in range(4):
+            field = (dwords[9] >> (4 + (7 * i))) & 0x7F
+            erase_times[i] = _time(
+                field & 0x1F, (0.001, 0.016, 0.128, 1)[field >> 5],
+                multiplier)
+        multiplier = 2 * ((dwords[10] & 0xF) + 1)
+        page_size = 1 << ((dwords[10] >> 4) & 0xF)
+        page_program = _time(
+            (dwords[10] >> 8) & 0x1F,
+            0.000064 if dwords[10] & 0x2000 else 0.000008, multiplier)
+        chip_erase = _time(
+            (dwords[10] >> 24) & 0x1F,
+            (0.016, 0.256, 4, 64)[(dwords[10] >> 29) & 0x3], multiplier)
+    erases = dict()
+    for i in range(4):
+        field = (dwords[7 + (i // 2)] >> (16 * (i % 2))) & 0xFFFF
+        if field & 0xFF == 0:
+            continue  # Erase type not supported
+        erase_size = 1 << (field & 0xFF)
+        times = erase_times[i]
+        if times is None:
+            times = GENERIC.erases.get(erase_size, (None, (0, 100)))[1]
+        erases[erase_size] = (field >> 8, times)
+    if not erases:
+        return None
+    return FlashChip(
+        name, size, page_size, erases, page_program, chip_erase,
+        GENERIC.read_frequency)
+
+
+def lookup(jedec_id, sfdp_table=None):
+    """Returns FlashChip for chip with given JEDEC ID. If chip is not known
+    then it is described using SFDP Basic Flash Parameter Table (if provided)
+    or GENERIC is returned."""
+    if jedec_id in CHIPS:
+        return CHIPS[jedec_id]
+    return from_sfdp("SFDP " + hex(jedec_id), sfdp_table) or GENERIC
@@ -56,6 +56,8 @@ class MoxImager:
         """
         # Prepare moxtester
         self.moxtester.default()
+        # Boot mode has to be set before power up and reset released only
+        # after that so these are not batched to single pin transaction.
         self.moxtester.set_boot_mode(self.moxtester.BOOT_MODE_UART)
         self.moxtester.power(True)
         self.moxtester.reset(False)
@@ -0,0 +1,135 @@
+"MPSSE program compiler for SPI operations"
+from .backend import ftdi
+
+_WRITE = ftdi.MPSSE_DO_WRITE | ftdi.MPSSE_WRITE_NEG
+_READ = ftdi.MPSSE_DO_READ
+
+
+def clock_delay(seconds, frequency):
+    """Returns list of MPSSE operations that clock for given time without data
+    transfer. It is used to implement delays performed by MPSSE and not by
+    host."""
+    size = -(-int(seconds * frequency) // 8)  # Clocked in bytes
+    operations = []
+    while size > 0:
+        chunk = min(size, 0x10000)
+        operations.append(bytes((
+            ftdi.CLK_BYTES, (chunk - 1) % 0x100, (chunk - 1) // 0x100)))
+        size = size - chunk
+    return operations
+
+
+class SPIBurst:
+    """Program for MPSSE composed of SPI commands.
+    Operations are recorded to preallocated buffer and program is split to USB
+    transfers so that every transfer respects buffer sizes of FTDI chip.
+    Instances should be created by _SPIInterface.spi_burst_new and executed by
+    _SPIInterface.spi_burst.
+    """
+    TX_LIMIT = 2048  # Transmit buffer size of FT4232H
+    RX_LIMIT = 2048  # Receive buffer size of FT4232H
+    _HEADERS = dict()  # Cache of precomputed command headers
+
+    def __init__(self, gpio_value, output_mask, frequency, capacity=4096):
+        self.frequency = frequency
+        self._select = bytes((
+            ftdi.SET_BITS_LOW, (gpio_value & 0xF0) | 0x01, output_mask))
+        self._release = bytes((
+            ftdi.SET_BITS_LOW, (gpio_value & 0xF0) | 0x09, output_mask))
+        self._buffer = bytearray(capacity)
+        self._size = 0
+        self._transfers = []  # Finished transfers (end offset and response)
+        self._start = 0  # Start of current transfer
+        self._response = 0  # Response size of current transfer
+        self.response_size = 0  # Total number of bytes read by this burst
+
+    @classmethod
+    def _header(cls, opcode, address_size):
+        """Returns precomputed MPSSE write of opcode and address of given size
+        (address itself is not part of it)."""
+        key = (opcode, address_size)
+        if key not in cls._HEADERS:
+            cls._HEADERS[key] = bytes((_WRITE, address_size, 0, opcode))
+        return cls._HEADERS[key]
+
+    def _append(self, *parts, response=0):
+        """Append single MPSSE operation composed of given parts. Operation is
+        never split between transfers. response is number of bytes this
+        operation reads."""
+        size = sum(len(part) for part in parts)
+        if self._size > self._start and (
+                (response and self._response and
+                 self._response + response > self.RX_LIMIT) or
+                self._size + size - self._start > self.TX_LIMIT):
+            self._split()
+        if self._size + size > len(self._buffer):
+            self._buffer.extend(bytes(max(size, len(self._buffer))))
+        for part in parts:
+            self._buffer[self._size:(self._size + len(part))] = part
+            self._size = self._size + len(part)
+        self._response = self._response + response
+        self.response_size = self.response_size + response
+
+    def _split(self):
+        "Finish current transfer"
+        self._transfers.append((self._size, self._response))
+        self._start = self._size
+        self._response = 0
+
+    def _write(self, data):
+        for i in range(0, len(data), 0x10000):
+            size = min(len(data) - i, 0x10000)
+            self._append(bytes((
+                _WRITE, (size - 1) % 0x100, (size - 1) // 0x100)),
+                data[i:(i + size)])
+
+    def _read(self, size):
+        # Reads are split so every one fits to receive buffer and transfers
+        # with them can be pipelined.
+        for i in range(0, size, self.RX_LIMIT):
+            chunk = min(size - i, self.RX_LIMIT)
+            self._append(bytes((
+                _READ, (chunk - 1) % 0x100, (chunk - 1) // 0x100)),
+                response=chunk)
+
+    def command(self, opcode, address=None, data=None, read=0, dummy=0):
+        """Add single SPI command. Chip select is asserted for the time of
+        command.
+        opcode: command code
+        address: optional address (3 bytes) sent after opcode
+        data: optional bytes written after address
+        read: number of bytes read at the end of command
+        dummy: number of dummy bytes sent after address
+        """
+        self._append(self._select)
+        if address is None:
+            self._append(self._header(opcode, 0))
+        else:
+            self._append(
+                self._header(opcode, 3 + dummy),
+                address.to_bytes(3, 'big'), bytes(dummy))
+        if data is not None and len(data) > 0:
+            self._write(data)
+        if read > 0:
+            self._read(read)
+        self._append(self._release)
+
+    def delay(self, seconds):
+        """Add delay between commands. Delay is implemented by clocking
+        without data transfer so it is performed by MPSSE and not by host.
+        """
+        for operation in clock_delay(seconds, self.frequency):
+            self._append(operation)
+
+    def transfers(self):
+        """Returns list of transfers. Every transfer is tuple with memoryview
+        of bytes to be written and number of bytes to be read back."""
+        if self._size > self._start:
+            self._split()
+        view = memoryview(self._buffer)
+        transfers = []
+        start = 0
+        for end, response in self._transfers:
+            transfers.append((view[start:end], response))
+            start = end
+        return transfers
@@ -0,0 +1,224 @@
+"Single thread servicing UART channels of all testers"
+import sys
+import socket
+import selectors
+from time import monotonic
+from threading import Thread, Lock, Event, current_thread
+from .backend import ftdi
+from .. import report
+
+
+class UARTChannel:
+    """UART of one tester serviced by UARTReactor.
+    Data received from FTDI are written to sock and data read from sock are
+    written to FTDI. ctx is ftdi context opened on UART interface.
+    on_receive and on_transmit are called (in reactor thread) with every
+    received and transmitted chunk. They should not block.
+    """
+    READ_SIZE = 256  # Maximal number of bytes read from FTDI at once
+    WRITE_SIZE = 512  # Maximal number of bytes written to FTDI at once
+    PENDING_LIMIT = 0x10000  # FTDI is not read if this many bytes are pending
+    IDLE_TIMEOUT = 1  # Seconds without data after which channel is idle
+    IDLE_POLL = 0.05  # Period of FTDI reads (in seconds) of idle channel
+
+    def __init__(self, ctx, sock, on_receive=None, on_transmit=None):
+        self.ctx = ctx
+        self.sock = sock
+        self.on_receive = on_receive
+        self.on_transmit = on_transmit
+        self.pending = bytearray()  # Received data not yet accepted by sock
+        self.last_activity = monotonic()
+        self.next_poll = 0
+        self.registered = None  # Events channel is registered for
+        self.closed = Event()
+
+    def transmit(self):
+        "Pass data available in sock to FTDI"
+        data = self.sock.recv(self.WRITE_SIZE)
+        if not data:
+            raise EOFError("UART socket closed")
+        if ftdi.write_data(self.ctx, data) < 0:
+            raise IOError("UART Write failed")
+        if self.on_transmit is not None:
+            self.on_transmit(data)
+        self.last_activity = monotonic()  # Response is expected
+        self.next_poll = 0
+
+    def poll_time(self):
+        """Time when FTDI should be read next. None is returned if reading is
+        blocked as socket does not accept data."""
+        if len(self.pending) >= self.PENDING_LIMIT:
+            return None
+        return self.next_poll
+
+    def receive(self, now):
+        "Read data from FTDI if channel is due and there is space for them"
+        poll_time = self.poll_time()
+        if poll_time is None or now < poll_time:
+            return
+        # Read blocks at most for FTDI latency timer if there are no data
+        ret, data = ftdi.read_data(self.ctx, self.READ_SIZE)
+        if ret < 0:
+            raise IOError("UART Read failed")
+        if ret > 0:
+            self.last_activity = now
+            self.pending += data[0:ret]
+            self.flush()
+            if self.on_receive is not None:
+                self.on_receive(bytes(data[0:ret]))
+        if now - self.last_activity > self.IDLE_TIMEOUT:
+            self.next_poll = now + self.IDLE_POLL
+        else:
+            self.next_poll = 0
+
+    def flush(self):
+        "Pass as much of pending data to sock as it accepts"
+        try:
+            sent = self.sock.send(self.pending)
+        except BlockingIOError:
+            return
+        del self.pending[0:sent]
+
+    def events(self):
+        "Selector events this channel waits for"
+        if self.pending:
+            return selectors.EVENT_READ | selectors.EVENT_WRITE
+        return selectors.EVENT_READ
+
+
+class UARTReactor:
+    """Event loop servicing all registered UART channels in one thread.
+    Sockets are handled by selector and FTDI is read in round robin. Active
+    channels are read continuously and idle ones only every IDLE_POLL seconds.
+    Channel stops being read from FTDI when its socket does not accept data
+    (backpressure). Thread is started with first channel and exits when last
+    one is removed.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._thread = None
+        self._selector = None  # Selector of running reactor thread
+        self._channels = []
+        self._added = []
+        self._removed = []
+        self._wakeup = None
+
+    def add(self, channel):
+        "Start servicing given channel"
+        channel.sock.setblocking(False)
+        with self._lock:
+            self._added.append(channel)
+            if self._thread is None:
+                self._wakeup = socket.socketpair()
+                self._wakeup[0].setblocking(False)
+                self._wakeup[1].setblocking(False)
+                self._thread = Thread(
+                    target=self._run, name="UART reactor", daemon=True)
+                self._thread.start()
+            else:
+                self._wake()
+
+    def remove(self, channel, _is_finalizing=sys.is_finalizing):
+        """Stop servicing given channel. Returns after reactor released it
+        (it no longer uses its sock and ctx)."""
+        with self._lock:
+            if channel.closed.is_set():
+                return
+            if current_thread() is self._thread:
+                # Called in reactor loop (for example by finalizer run by
+                # garbage collection) so waiting for loop would deadlock.
+                if channel in self._added:
+                    self._added.remove(channel)
+                self._release(self._selector, channel)
+                return
+            self._removed.append(channel)
+            self._wake()
+        # Note: is_finalizing is bound as default argument as module globals
+        # can be already cleared when this is called from __del__ on exit.
+        if _is_finalizing():
+            return  # Daemon reactor thread no longer runs
+        channel.closed.wait()
+
+    def _wake(self):
+        try:
+            self._wakeup[1].send(b'\0')
+        except BlockingIOError:
+            pass  # Wakeup is already pending
+
+    def _update(self, selector):
+        "Apply pending additions and removals. Returns False if loop is over."
+        with self._lock:
+            for channel in self._added:
+                self._channels.append(channel)
+                channel.registered = channel.events()
+                selector.register(channel.sock, channel.registered, channel)
+            self._added = []
+            for channel in self._removed:
+                self._release(selector, channel)
+            self._removed = []
+            if not self._channels:
+                self._wakeup[0].close()
+                self._wakeup[1].close()
+                self._wakeup = None
+                self._thread = None
+                return False
+        return True
+
+    def _release(self, selector, channel):
+        if channel in self._channels:
+            self._channels.remove(channel)
+            selector.unregister(channel.sock)
+        channel.closed.set()
+
+    def _run(self):
+        selector = selectors.DefaultSelector()
+        self._selector = selector
+        selector.register(self._wakeup[0], selectors.EVENT_READ)
+        while self._update(selector):
+            times = [
+                channel.poll_time() for channel in self._channels
+                if channel.poll_time() is not None]
+            timeout = max(0, min(times) - monotonic()) if times else None
+            for key, mask in selector.select(timeout):
+                if key.data is None:
+                    key.fileobj.recv(1024)
+                    continue
+                if key.data.closed.is_set():
+                    continue  # Removed while handling previous events
+                try:
+                    if mask & selectors.EVENT_READ:
+                        key.data.transmit()
+                    if mask & selectors.EVENT_WRITE:
+                        key.data.flush()
+                except Exception:
+                    self._fail(selector, key.data)
+            now = monotonic()
+            for channel in list(self._channels):
+                if channel.closed.is_set():
+                    continue
+                try:
+                    channel.receive(now)
+                except Exception:
+                    self._fail(selector, channel)
+                    continue
+                if channel.events() != channel.registered:
+                    channel.registered = channel.events()
+                    selector.modify(channel.sock, channel.registered, channel)
+        selector.close()
+
+    def _fail(self, selector, channel):
+        "Drop channel that failed. Its socket is shut down to signal EOF."
+        report.ignored_exception()
+        with self._lock:
+            if channel not in self._channels:
+                return
+            self._release(selector, channel)
+        try:
+            channel.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+# Reactor shared by whole process
+REACTOR = UARTReactor()
@@ -0,0 +1,194 @@
+"Process wide registry of Mox testers connected to USB"
+import weakref
+from threading import RLock
+from .backend import ftdi, usb_location
+from .exceptions import MoxTesterNotFoundException
+from .exceptions import MoxTesterCommunicationException
+
+
+class _Scan:
+    """Context and device list of single enumeration. Devices listed by it are
+    valid only as long as they are not freed."""
+
+    def __init__(self, ctx, devs):
+        self.ctx = ctx
+        self.devs = devs
+        self.users = 0  # Number of leases of devices handed out from it
+
+    def free(self):
+        "Free device list and context"
+        ftdi.list_free(self.devs)
+        ftdi.free(self.ctx)
+
+
+class _Lease:
+    """Hold of device listed by enumeration. Enumeration is not freed as long
+    as any lease of its device is not released."""
+
+    def __init__(self, registry, scan, dev):
+        self.dev = dev
+        self._registry = registry
+        self._scan = scan
+        registry._hold(scan)
+
+    def share(self):
+        "Returns new lease of the same device"
+        return _Lease(self._registry, self._scan, self.dev)
+
+    def release(self):
+        """Release device. Device must not be used after this. It can be
+        called multiple times."""
+        scan = self._scan
+        if scan is not None:
+            self._scan = None
+            self._registry._release(scan)
+
+
+class TesterRegistry:
+    """Registry mapping tester ID to FTDI USB device.
+    USB bus is enumerated only on first use and then on explicit request (for
+    example on hotplug event). Enumeration opens, identifies and resets only
+    devices that are not in use. Testers in use can't be opened so they are
+    never reset and their devices are kept from previous enumeration as long
+    as there is device on the same USB location.
+    """
+    VENDOR_ID = 0x0403
+    PRODUCT_ID = 0x6011
+
+    def __init__(self):
+        # Lock is reentrant as devices are released from finalizers of their
+        # owners and those can run in garbage collection in any locked section
+        self._lock = RLock()
+        self._devices = None  # Tester ID to USB location, device and _Scan
+        self._locations = None  # USB locations seen by last enumeration
+        # Enumerations with devices that can be still in use. The last one is
+        # always kept.
+        self._scans = []
+
+    def scan(self):
+        """Enumerate USB bus and identify all testers that are not in use.
+        Returns sorted list of IDs of known testers."""
+        with self._lock:
+            self._scan()
+            return sorted(self._devices)
+
+    def _scan(self):
+        ctx = ftdi.new()
+        ret, devs = ftdi.usb_find_all(ctx, self.VENDOR_ID, self.PRODUCT_ID)
+        if ret < 0:
+            ftdi.free(ctx)
+            raise MoxTesterCommunicationException("Unable to list USB devices")
+        scan = _Scan(ctx, devs)
+        self._scans.append(scan)
+        previous = {  # USB location to tester ID and its entry
+            entry[0]: (tester_id, entry)
+            for tester_id, entry in (self._devices or {}).items()}
+        devices = dict()
+        locations = set()
+        while devs is not None:
+            location = usb_location(devs.dev)
+            locations.add(location)
+            # Device that fails open is in use so previous mapping is kept
+            if ftdi.usb_open_dev(ctx, devs.dev) == 0:
+                devices[self._identify(ctx)] = (location, devs.dev, scan)
+            elif location in previous:
+                tester_id, entry = previous[location]
+                devices[tester_id] = entry
+            devs = devs.next
+        self._devices = devices
+        self._locations = locations
+        self._collect()
+
+    @staticmethod
+    def _identify(ctx):
+        "Returns ID of tester opened in given context and closes it"
+        if ftdi.read_eeprom(ctx) < 0:
+            raise MoxTesterCommunicationException("EEPROM read failed")
+        if ftdi.eeprom_decode(ctx, 0) < 0:
+            raise MoxTesterCommunicationException('EEPROM decode failed')
+        ret, chip_tp = ftdi.get_eeprom_value(ctx, ftdi.CHIP_TYPE)
+        if ret < 0:
+            raise MoxTesterCommunicationException(
+                "Reading chip type (id) failed")
+        if ftdi.usb_reset(ctx) != 0:
+            raise MoxTesterCommunicationException(
+                "FTDI USB device reset failed")
+        if ftdi.usb_close(ctx) != 0:
+            raise MoxTesterCommunicationException(
+                "FTDI USB device close failed")
+        return chip_tp
+
+    def _collect(self):
+        """Free enumerations that are not the last one, have no devices in
+        registry and no devices handed out."""
+        used = {id(scan) for _, _, scan in (self._devices or {}).values()}
+        for scan in self._scans[:-1]:
+            if scan.users == 0 and id(scan) not in used:
+                self._scans.remove(scan)
+                scan.free()
+
+    def _hold(self, scan):
+        "Called when device from given enumeration is leased"
+        with self._lock:
+            scan.users += 1
+
+    def _release(self, scan):
+        "Called when lease of device from given enumeration is released"
+        with self._lock:
+            scan.users -= 1
+            self._collect()
+
+    def changed(self):
+        """Check if FTDI devices on USB bus changed since last enumeration.
+        Devices are only listed and not opened, so this is cheap enough to be
+        polled in place of hotplug notification. Device replaced by another
+        one is detected as its USB address changes."""
+        ctx = ftdi.new()
+        try:
+            ret, devs = ftdi.usb_find_all(
+                ctx, self.VENDOR_ID, self.PRODUCT_ID)
+            if ret < 0:
+                raise MoxTesterCommunicationException(
+                    "Unable to list USB devices")
+            locations = set()
+            item = devs
+            while item is not None:
+                locations.add(usb_location(item.dev))
+                item = item.next
+            ftdi.list_free(devs)
+        finally:
+            ftdi.free(ctx)
+        with self._lock:
+            return locations != self._locations
+
+    def device(self, tester_id, owner, rescan=False):
+        """Returns lease of libusb device of tester with given ID. Bus is
+        enumerated only if it was not enumerated yet or rescan is True. owner
+        is object device is handed to. Lease is released once owner is gone.
+        Objects that use device and can outlive owner (such as open FTDI
+        contexts) have to hold their own shared lease."""
+        with self._lock:
+            if self._devices is None or rescan:
+                self._scan()
+            if tester_id not in self._devices:
+                raise MoxTesterNotFoundException(
+                    "There is no connected tester with id: " + str(tester_id))
+            _, dev, scan = self._devices[tester_id]
+            lease = _Lease(self, scan, dev)
+            weakref.finalize(owner, lease.release)
+            return lease
+
+    def forget(self, tester_id):
+        """Drop tester with given ID from registry. It is identified again on
+        next enumeration. Use this when tester stops responding. It also
+        makes changed report change so tester replugged in between polls is
+        not missed."""
+        with self._lock:
+            if self._devices is not None:
+                self._devices.pop(tester_id, None)
+            self._locations = None
+            self._collect()
+
+
+# Registry shared by whole process
+REGISTRY = TesterRegistry()
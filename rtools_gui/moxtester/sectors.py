@@ -0,0 +1,186 @@
+"Helpers comparing content of SPI Flash with data that should be written to it"
+import hashlib
+
+SECTOR_IDENTICAL = 0  # Sector already contains required data
+SECTOR_PROGRAM = 1  # Sector can be updated by page program only
+SECTOR_ERASE = 2  # Sector has to be erased before page program
+
+
+def same(first, second):
+    """Compare content of two bytes-like objects. Memoryviews are compared by
+    Python item by item which is slow. bytearray compares any buffer using
+    memcmp so comparison is done by it (copy is made only if neither argument
+    is bytearray)."""
+    if isinstance(second, bytearray):
+        return second == first
+    if not isinstance(first, bytearray):
+        first = bytearray(first)
+    return first == second
+
+
+def classify(current, target):
+    """Returns what has to be done to change current content of memory to
+    target one. Both arguments are bytes-like objects of same length. Returned
+    value is one of SECTOR_* constants."""
+    if same(current, target):
+        return SECTOR_IDENTICAL
+    # Page program can only clear bits so we have to erase sector if there is
+    # any bit set in target that is not set in current content. Whole sector is
+    # compared at once as a single integer.
+    if int.from_bytes(target, 'big') & ~int.from_bytes(current, 'big'):
+        return SECTOR_ERASE
+    return SECTOR_PROGRAM
+
+
+def classify_sectors(current, target, sector_size=0x1000):
+    """Split current content of memory and target data to sectors and classify
+    every one of them using classify function. Returns list of SECTOR_*
+    constants. Last sector can be shorter than sector_size."""
+    return [
+        classify(
+            current[i:(i + sector_size)], target[i:(i + sector_size)])
+        for i in range(0, len(target), sector_size)
+    ]
+
+
+def blank_pages(data, page_size=256):
+    """Returns set of offsets of pages in data that contain only erased value
+    (0xFF). Such pages do not have to be programmed after erase. Last page can
+    be shorter than page_size."""
+    blank = bytearray(b'\xff') * page_size
+    return {
+        offset for offset in range(0, len(data), page_size)
+        if same(
+            blank[:(len(data) - offset)], data[offset:(offset + page_size)])
+    }
+
+
+def plan_erase(address, erase, keep_cost, erase_times):
+    """Plan erase operations so that all sectors that have to be erased are
+    erased and it takes as little time as possible. Sectors that have to be
+    erased can be coalesced to bigger aligned blocks if it is cheaper to erase
+    whole block and restore content of sectors that did not need erase.
+    address: address of first sector (aligned to sector)
+    erase: sequence of booleans, True for every sector that has to be erased
+    keep_cost(address): function returning estimated time (in seconds) needed
+        to restore content of sector on given address if it is erased
+    erase_times: dictionary with supported erase sizes (in bytes) as keys and
+        time of erase (in seconds) as values. Smallest size is sector size.
+    Returns list of tuples with address and size of erase operations.
+    """
+    sizes = sorted(erase_times)
+    sector = sizes[0]
+    dirty = {address + (i * sector) for i, value in enumerate(erase) if value}
+
+    def _plan(block, size):
+        sectors = range(block, block + size, sector)
+        if not dirty.intersection(sectors):
+            return 0, []
+        if size == sector:
+            return erase_times[size], [(block, size)]
+        smaller = sizes[sizes.index(size) - 1]
+        split_cost, split_plan = 0, []
+        for sub in range(block, block + size, smaller):
+            cost, plan = _plan(sub, smaller)
+            split_cost = split_cost + cost
+            split_plan = split_plan + plan
+        whole_cost = erase_times[size] + sum(
+            keep_cost(addr) for addr in sectors if addr not in dirty)
+        if whole_cost < split_cost:
+            return whole_cost, [(block, size)]
+        return split_cost, split_plan
+
+    largest = sizes[-1]
+    plan = []
+    for block in range(address - (address % largest),
+                       address + (len(erase) * sector), largest):
+        plan = plan + _plan(block, largest)[1]
+    return plan
+
+
+class SectorIndex:
+    """Precomputed description of image used to compare it with content of
+    SPI Flash without comparing data itself. Content read from SPI Flash can
+    be compared with index only so image data are accessed only in sectors
+    that differ.
+    size: size of image in bytes
+    sector_size, page_size: geometry index was computed for
+    sectors: list with SHA256 digest (in hex) of every sector
+    pages: list with SHA256 digest (in hex) of every page
+    blank: set of offsets of pages that contain only erased value (0xFF)
+    digest: SHA256 digest (in hex) of whole image
+    """
+    VERSION = 2  # Version of format returned by to_dict
+
+    def __init__(self, size, sector_size, page_size, sectors, pages, blank,
+                 digest):
+        self.size = size
+        self.sector_size = sector_size
+        self.page_size = page_size
+        self.sectors = sectors
+        self.pages = pages
+        self.blank = blank
+        self.digest = digest
+
+    @classmethod
+    def build(cls, data, sector_size=0x1000, page_size=256):
+        "Compute index of given data"
+        return cls(
+            len(data), sector_size, page_size, [
+                hashlib.sha256(data[i:(i + sector_size)]).hexdigest()
+                for i in range(0, len(data), sector_size)], [
+                hashlib.sha256(data[i:(i + page_size)]).hexdigest()
+                for i in range(0, len(data), page_size)],
+            blank_pages(data, page_size), hashlib.sha256(data).hexdigest())
+
+    def matches(self, sector_size, page_size):
+        "Check if index was computed for given geometry"
+        return self.sector_size == sector_size and self.page_size == page_size
+
+    def same_sector(self, offset, content):
+        "Check if content is same as sector of image on given offset"
+        return hashlib.sha256(content).hexdigest() == \
+            self.sectors[offset // self.sector_size]
+
+    def same_page(self, offset, content):
+        "Check if content is same as page of image on given offset"
+        return hashlib.sha256(content).hexdigest() == \
+            self.pages[offset // self.page_size]
+
+    def classify_sectors(self, current, data):
+        """Same as classify_sectors but sectors of current content are compared
+        with index. Image data are used only to classify sectors that
+        differ."""
+        sector = self.sector_size
+        return [
+            SECTOR_IDENTICAL if self.same_sector(i, current[i:(i + sector)])
+            else classify(current[i:(i + sector)], data[i:(i + sector)])
+            for i in range(0, self.size, sector)
+        ]
+
+    def sector_digests(self, address):
+        """Returns sector digests of image placed on given address in format
+        of flashcache.sector_digests."""
+        return {
+            address + (i * self.sector_size): digest
+            for i, digest in enumerate(self.sectors)}
+
+    def to_dict(self):
+        "Returns dictionary with index that can be stored as JSON"
+        return {
+            'size': self.size,
+            'sector_size': self.sector_size,
+            'page_size': self.page_size,
+            'sectors': self.sectors,
+            'pages': self.pages,
+            'blank': sorted(self.blank),
+            'digest': self.digest,
+        }
+
+    @classmethod
+    def from_dict(cls, value):
+        "Create index from dictionary returned by to_dict"
+        return cls(
+            value['size'], value['sector_size'], value['page_size'],
+            value['sectors'], value['pages'], set(value['blank']),
+            value['digest'])
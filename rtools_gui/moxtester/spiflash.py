@@ -1,5 +1,24 @@
-from time import sleep
+import hashlib
+from time import sleep, monotonic
+from collections import namedtuple
 from .exceptions import MoxTesterSPIFLashUnalignedException
+from .exceptions import MoxTesterSPIFlashTimeoutException
+from .sectors import classify_sectors, plan_erase, blank_pages, same
+from .sectors import SECTOR_IDENTICAL, SECTOR_ERASE
+from .flashcache import sector_digests
+from . import flashchips
+
+VERIFY_NONE = 'none'  # Region is only written
+VERIFY_FULL = 'full'  # Region is read back and compared after write
+VERIFY_READBACK = 'readback'  # Only programmed pages are read back
+
+# Region of SPI Flash in flash plan executed by SPIFlash.write_plan. It has
+# name used to report progress and results, address aligned to sector, data
+# to be written there, verify policy (one of VERIFY_* constants) and optional
+# precomputed SectorIndex of data.
+FlashRegion = namedtuple(
+    'FlashRegion', ('name', 'address', 'data', 'verify', 'index'),
+    defaults=(None,))
 
 
 class SPIFlash():
@@ -13,39 +32,81 @@ class SPIFlash():
     _ENABLE_RESET = 0x66
     _RESET_DEVICE = 0x99
     _CHIP_ERASE = 0x60  # 0xC7 seems to be also valid
-    _SECTOR_ERASE = 0x20
     _PAGE_PROGRAM = 0x02
     _READ_DATA = 0x03
+    _FAST_READ = 0x0B
+    _READ_SFDP = 0x5A
+    _READ_UNIQUE_ID = 0x4B
+    # Page program tuning. It is tuple with number of pages programmed in
+    # single burst and time in seconds reserved for every page program. Pages
+    # in burst are separated by delays performed by MPSSE. If burst contains
+    # only single page then delay is performed on host side instead. In
+    # default time is maximal page program time of chip.
+    _PROGRAM_BATCH = 8
+    # Page program tuning overrides for specific chips (key is JEDEC ID). Use
+    # (1, 0.005) for chip that does not work with device side delays.
+    _PROGRAM_TUNING_CHIPS = {}
+    _POLL_PROBES = 4  # Number of status register reads in single burst
+    _POLL_SPACING = 0.0005  # Delay between status register reads in burst
+    _POLL_BACKOFF_MIN = 0.001  # Minimal delay between bursts
+    # SPI clock frequencies tried by calibration. These are ordered from the
+    # fastest one and last one has to be safe frequency of SPI interface.
+    _FREQUENCIES = (30000000, 15000000, 10000000, 7500000, 6000000)
+    _CALIBRATION_SIZE = 0x10000  # Bytes read to check clock stability
+    _CALIBRATION_SFDP = 0x100  # Bytes of SFDP read to check clock stability
+    _CALIBRATION_ROUNDS = 3  # Number of reads every frequency has to pass
+    _BLANK_SAMPLE = 16  # Bytes read from start of every sector to detect blank
 
     def __init__(self, moxtester, spi_interface):
         self.moxtester = moxtester
         self.spi = spi_interface
+        self.jedec = None  # JEDEC ID of identified chip
+        self.chip = None
+        self.program_tuning = None  # Page program tuning for current chip
+        # Typical and maximal time in seconds of operations that make SPI
+        # Flash busy. Keys are 'unknown', 'page', 'chip' and erase sizes.
+        # These are used to pace status polling and as a deadline.
+        self.busy_times = None
+        self._use_chip(flashchips.GENERIC)
+        # Counters of work done in this session
+        self.stats = {
+            'pages_programmed': 0,  # Page program commands sent
+            'pages_blank': 0,  # Erased pages not programmed as data are blank
+            'regions_cached': 0,  # Regions only verified thanks to cache
+            'regions_blank': 0,  # Regions written without read as blank
+        }
 
     def __enter__(self):
-        self.spi.spi_enable(True)
-        # Note: setting boot mode to UART is required because otherwise CPU has
-        # SPI ports configured as outputs and interferes with our SPI usage.
-        # This is happening even if CPU is in reset!
-        self.moxtester.set_boot_mode(self.moxtester.BOOT_MODE_UART)
-        self.moxtester.reset(True)
-        self.moxtester.power(True)
+        with self.moxtester.pins():
+            self.spi.spi_enable(True)
+            # Note: setting boot mode to UART is required because otherwise CPU
+            # has SPI ports configured as outputs and interferes with our SPI
+            # usage. This is happening even if CPU is in reset!
+            self.moxtester.set_boot_mode(self.moxtester.BOOT_MODE_UART)
+            self.moxtester.reset(True)
+            self.moxtester.power(True)
+        if self.moxtester.spi_frequency is None:
+            self.calibrate()
+        else:
+            self.spi.set_frequency(self.moxtester.spi_frequency)
+        self.identify()
         return self
 
     def __exit__(self, etype, value, traceback):
-        self.moxtester.power(False)
-        self.moxtester.set_boot_mode(self.moxtester.BOOT_MODE_SPI)
-        # Note: left CPU in reset
-        self.spi.spi_enable(False)
+        with self.moxtester.pins():
+            self.moxtester.power(False)
+            self.moxtester.set_boot_mode(self.moxtester.BOOT_MODE_SPI)
+            # Note: left CPU in reset
+            self.spi.spi_enable(False)
 
     def reset_device(self):
         """Reset SPI Flash device and suspends execution for time to ensure
         device reset completion."""
         self.busy_wait()
-        self.spi.spi_burst_new()
-        self.spi.spi_burst_write_int(self._ENABLE_RESET)
-        self.spi.spi_burst_cs_reset()
-        self.spi.spi_burst_write_int(self._RESET_DEVICE)
-        self.spi.spi_burst()
+        burst = self.spi.spi_burst_new()
+        burst.command(self._ENABLE_RESET)
+        burst.command(self._RESET_DEVICE)
+        self.spi.spi_burst(burst)
         sleep(0.001)  # This should be longer than 30us
         # Note: Documentation states that reset takes approximately 30us.
         # Originally 100us was used but it sometimes wasn't enough. Because of
@@ -53,101 +114,350 @@ class SPIFlash():
         # some reason flashing fails then it might be again because of this and
         # this time can be even increased.
 
+    def _calibration_reference(self):
+        """Read data used to check clock stability. Returns tuple with JEDEC
+        ID, start of SFDP space and start of SPI Flash content."""
+        return (
+            self.jedec_id(), self.sfdp(0, self._CALIBRATION_SFDP),
+            self.read_data(0, self._CALIBRATION_SIZE))
+
+    def calibrate(self):
+        """Select the fastest SPI clock that is stable on this tester. JEDEC ID,
+        SFDP and data are read with safe clock first and then frequencies are
+        tried from the fastest one until one is found where repeated reads
+        return the same content. Reads of uniform content (for example SFDP of
+        chip without it and data of blank chip) pass even with unstable clock,
+        so if there is nothing else safe clock is used. Only frequency selected
+        using varying content is stored to MoxTester so it is used by all
+        following sessions. Returns selected frequency.
+        """
+        safe = self._safe_frequency()
+        self.spi.set_frequency(safe)
+        self.reset_device()
+        reference = self._calibration_reference()
+        if all(part.count(part[0]) == len(part) for part in reference[1:]):
+            return self.spi.frequency
+        candidates = [
+            freq for freq in self._FREQUENCIES
+            if safe < freq <= self.moxtester.spi_max_frequency]
+        for frequency in candidates:
+            self.spi.set_frequency(frequency)
+            if all(self._calibration_reference() == reference
+                   for _ in range(self._CALIBRATION_ROUNDS)):
+                break
+        else:
+            self.spi.set_frequency(safe)
+        self.moxtester.spi_frequency = self.spi.frequency
+        return self.spi.frequency
+
+    def _safe_frequency(self):
+        "Returns SPI clock frequency that is considered safe on this tester"
+        return min(self._FREQUENCIES[-1], self.moxtester.spi_max_frequency)
+
+    def fallback(self):
+        """Switch to safe SPI clock for the rest of this session. This should
+        be called when verification fails. Calibrated clock stored in
+        MoxTester is kept so following sessions (boards) are not affected.
+        Returns False if safe clock is already used.
+        """
+        safe = self._safe_frequency()
+        if self.spi.frequency <= safe:
+            return False
+        self.spi.set_frequency(safe)
+        return True
+
+    def _use_chip(self, chip, jedec=None):
+        "Use given FlashChip for all timing and geometry decisions"
+        self.jedec = jedec
+        self.chip = chip
+        self.program_tuning = self._PROGRAM_TUNING_CHIPS.get(
+            jedec, (self._PROGRAM_BATCH, chip.page_program[1]))
+        self.busy_times = {
+            'unknown': (0, 100),
+            'page': chip.page_program,
+            'chip': chip.chip_erase,
+        }
+        for size, (_, times) in chip.erases.items():
+            self.busy_times[size] = times
+
+    def sfdp(self, address, size):
+        "Read given number of bytes from SFDP tables on given address"
+        burst = self.spi.spi_burst_new()
+        burst.command(self._READ_SFDP, address, read=size, dummy=1)
+        return self.spi.spi_burst(burst)
+
+    def sfdp_basic_table(self):
+        """Returns JEDEC Basic Flash Parameter Table read from SFDP or None if
+        chip does not support SFDP."""
+        header = self.sfdp(0, 16)
+        if header[0:4] != b'SFDP' or header[8] != 0x00:
+            return None
+        return self.sfdp(
+            int.from_bytes(header[12:15], 'little'), 4 * header[11])
+
+    def identify(self):
+        """Identify SPI Flash chip by its JEDEC ID. Chips missing in database
+        are described by their SFDP. Identified chip is used for all following
+        operations. Returns FlashChip."""
+        jedec = self.jedec_id()
+        chip = flashchips.CHIPS.get(jedec)
+        if chip is None:
+            chip = flashchips.lookup(jedec, self.sfdp_basic_table())
+        self._use_chip(chip, jedec)
+        return chip
+
     def write_enable(self, enable):
         "Set if write is enabled"
-        self.spi.spi_burst_new()
-        self.spi.spi_burst_write_int(
-            self._WRITE_ENABLE if enable else self._WRITE_DISABLE)
-        self.spi.spi_burst_int()
+        burst = self.spi.spi_burst_new()
+        burst.command(self._WRITE_ENABLE if enable else self._WRITE_DISABLE)
+        self.spi.spi_burst(burst)
 
     def status_registers(self):
         "Return status register"
-        self.spi.spi_burst_new()
-        self.spi.spi_burst_write_int(self._READ_STATUS_REGISTER_3)
-        self.spi.spi_burst_read()
-        self.spi.spi_burst_cs_reset()
-        self.spi.spi_burst_write_int(self._READ_STATUS_REGISTER_2)
-        self.spi.spi_burst_read()
-        self.spi.spi_burst_cs_reset()
-        self.spi.spi_burst_write_int(self._READ_STATUS_REGISTER_1)
-        self.spi.spi_burst_read()
-        return self.spi.spi_burst_int()
+        burst = self.spi.spi_burst_new()
+        burst.command(self._READ_STATUS_REGISTER_3, read=1)
+        burst.command(self._READ_STATUS_REGISTER_2, read=1)
+        burst.command(self._READ_STATUS_REGISTER_1, read=1)
+        return int.from_bytes(self.spi.spi_burst(burst), 'big')
+
+    def unique_id(self):
+        """Returns unique ID of chip (bytes) or None if chip does not seem to
+        support it."""
+        burst = self.spi.spi_burst_new()
+        burst.command(self._READ_UNIQUE_ID, 0, read=8, dummy=1)
+        unique_id = bytes(self.spi.spi_burst(burst))
+        if unique_id in (b'\xff' * 8, bytes(8)):
+            return None
+        return unique_id
 
     def jedec_id(self):
         "Returns JEDEC ID"
-        self.spi.spi_burst_new()
-        self.spi.spi_burst_write_int(self._JEDEC_ID)
-        self.spi.spi_burst_read(3)
-        return self.spi.spi_burst_int()
+        burst = self.spi.spi_burst_new()
+        burst.command(self._JEDEC_ID, read=3)
+        return int.from_bytes(self.spi.spi_burst(burst), 'big')
 
     def is_busy(self):
         "Returns True or False depending on if SPI Flash is busy or not."
-        self.spi.spi_burst_new()
-        self.spi.spi_burst_write_int(self._READ_STATUS_REGISTER_1)
-        self.spi.spi_burst_read()
-        return bool(self.spi.spi_burst_int() & 0x01)
-
-    def busy_wait(self):
-        "Busy wait until SPI Flash is not busy."
-        while self.is_busy():
-            pass
+        burst = self.spi.spi_burst_new()
+        burst.command(self._READ_STATUS_REGISTER_1, read=1)
+        return bool(self.spi.spi_burst(burst)[0] & 0x01)
 
-    def read_data(self, address, size=1, callback=None):
-        """Read data from SPI flash from given address. At single read it is
-        possible to read multiple bytes. Fot that purpose you can use size
-        argument.
+    def _poll_status(self):
+        """Read status register multiple times in single burst. Returns bytes
+        with all read values."""
+        burst = self.spi.spi_burst_new()
+        for i in range(self._POLL_PROBES):
+            if i > 0:
+                burst.delay(self._POLL_SPACING)
+            burst.command(self._READ_STATUS_REGISTER_1, read=1)
+        return self.spi.spi_burst(burst)
+
+    def busy_wait(self, operation='unknown'):
+        """Wait until SPI Flash is not busy. operation is one of keys of
+        busy_times and specifies what SPI Flash is busy with. It is used to
+        pace polling and to detect SPI Flash that is stuck.
+        Returns number of performed status register reads."""
+        typical, maximal = self.busy_times[operation]
+        deadline = None
+        # There is no point in polling before typical time elapses
+        wait = typical / 2
+        backoff = max(typical / 16, self._POLL_BACKOFF_MIN)
+        polls = 0
+        while True:
+            sleep(wait)
+            statuses = self._poll_status()
+            polls = polls + len(statuses)
+            if not all(status & 0x01 for status in statuses):
+                return polls
+            # Note: the first status read waits for all operations queued in
+            # MPSSE so deadline is counted from it.
+            if deadline is None:
+                deadline = monotonic() + 2 * maximal
+            elif monotonic() > deadline:
+                raise MoxTesterSPIFlashTimeoutException(
+                    "SPI Flash busy for too long: " + str(operation))
+            wait = backoff
+            backoff = min(2 * backoff, max(typical / 4, self._POLL_BACKOFF_MIN))
+
+    def _read_command(self):
+        """Returns opcode and number of dummy bytes of read command suitable
+        for current SPI clock."""
+        if self.spi.frequency > self.chip.read_frequency:
+            return self._FAST_READ, 1
+        return self._READ_DATA, 0
+
+    def sample_blank(self, address, size):
+        """Check by sampling if given range of SPI Flash is blank (erased).
+        Start of every sector in range is read, all in single burst. Returns
+        False if any sampled byte is not 0xFF. Note that True does not
+        guarantee that whole range is blank."""
+        opcode, dummy = self._read_command()
+        burst = self.spi.spi_burst_new()
+        for offset in range(0, size, self.chip.sector_size):
+            burst.command(
+                opcode, address + offset, dummy=dummy,
+                read=min(self._BLANK_SAMPLE, size - offset))
+        response = self.spi.spi_burst(burst)
+        return response == b'\xff' * len(response)
+
+    def read_stream(self, address, size, callback=None, into=None,
+                    digest=None):
+        """Read data from SPI flash from given address in chunks of 64KB. This
+        is generator yielding read chunks.
         callback(progress) argument is optional function that is called with
-        progress update. Progress is float value between 0 and 1."""
+        progress update. Progress is float value between 0 and 1.
+        into is optional writable buffer of at least given size where data are
+        read to. Yielded chunks are memoryviews to it in such case.
+        digest is optional hashlib object that is updated with read data.
+        """
         # We have maximum amount of possible read bytes per single read so we
         # have to do it multiple times
+        view = None if into is None else memoryview(into)
         sectors = self._sectors_count(size, 0x10000)
-        data = bytes()
+        opcode, dummy = self._read_command()
+
+        def _submit(i):
+            offset = 0x10000 * i
+            chunk_size = min(size - offset, 0x10000)
+            burst = self.spi.spi_burst_new()
+            burst.command(
+                opcode, address + offset, read=chunk_size, dummy=dummy)
+            return self.spi.spi_submit(
+                burst, None if view is None else
+                view[offset:(offset + chunk_size)])
+
+        # Next chunk is always submitted before previous one is collected so
+        # SPI transfers continue while chunk is processed.
+        pending = _submit(0) if sectors > 0 else None
         for i in range(sectors):
-            self.spi.spi_burst_new()
-            self.spi.spi_burst_write_int(self._READ_DATA)
-            self.spi.spi_burst_write_int(address + (0x10000 * i), 3)
-            if i >= (sectors - 1) and size % 0x10000 != 0:
-                self.spi.spi_burst_read(size % 0x10000)
-            else:
-                self.spi.spi_burst_read(0x10000)
-            data = data + self.spi.spi_burst()
+            following = _submit(i + 1) if i + 1 < sectors else None
+            chunk = self.spi.spi_collect(pending)
+            pending = following
+            if digest is not None:
+                digest.update(chunk)
             if callback is not None:
                 callback((i + 1) / sectors)
+            yield chunk
+
+    def read_data(self, address, size=1, callback=None, digest=None):
+        """Read data from SPI flash from given address. At single read it is
+        possible to read multiple bytes. Fot that purpose you can use size
+        argument.
+        callback(progress) argument is optional function that is called with
+        progress update. Progress is float value between 0 and 1.
+        digest is optional hashlib object that is updated with read data.
+        Returns bytearray with read data."""
+        data = bytearray(size)
+        for _ in self.read_stream(address, size, callback, data, digest):
+            pass
         return data
 
     def chip_erase(self):
-        """Erase content of chip."""
-        self.spi.spi_burst_new()
-        self.spi.spi_burst_write_int(self._WRITE_ENABLE)
-        self.spi.spi_burst_cs_reset()
-        self.spi.spi_burst_write_int(self._CHIP_ERASE)
-        self.spi.spi_burst()
-        self.busy_wait()
+        """Erase content of chip. Returns number of status register reads
+        performed while waiting for erase to finish."""
+        burst = self.spi.spi_burst_new()
+        burst.command(self._WRITE_ENABLE)
+        burst.command(self._CHIP_ERASE)
+        self.spi.spi_burst(burst)
+        return self.busy_wait('chip')
+
+    def _erase(self, size, address):
+        """Erase block of given size (one of erase sizes of chip). Returns
+        number of status register reads performed while waiting for erase to
+        finish."""
+        burst = self.spi.spi_burst_new()
+        burst.command(self._WRITE_ENABLE)
+        burst.command(self.chip.erases[size][0], address)
+        self.spi.spi_burst(burst)
+        return self.busy_wait(size)
 
     def sector_erase(self, address):
-        """Erase single 4KB sector."""
-        self.spi.spi_burst_new()
-        self.spi.spi_burst_write_int(self._WRITE_ENABLE)
-        self.spi.spi_burst_cs_reset()
-        self.spi.spi_burst_write_int(self._SECTOR_ERASE)
-        self.spi.spi_burst_write_int(address, 3)
-        self.spi.spi_burst()
-        self.busy_wait()
+        """Erase single sector (4KB on most chips). Returns number of status
+        register reads performed while waiting for erase to finish."""
+        return self._erase(self.chip.sector_size, address)
+
+    def block_erase(self, address, size=0x10000):
+        """Erase single block of given size (32KB or 64KB on most chips).
+        Returns number of status register reads performed while waiting for
+        erase to finish."""
+        if size not in self.chip.erases or size == self.chip.sector_size:
+            raise MoxTesterSPIFLashUnalignedException(
+                "Unsupported block size: " + hex(size))
+        return self._erase(size, address)
+
+    def _burst_page(self, burst, address, data):
+        "Add page program of single page to given burst."
+        burst.command(self._WRITE_ENABLE)
+        burst.command(self._PAGE_PROGRAM, address, data)
 
     def write_page(self, address, data):
-        """Write data to single page (256B) in SPI Flash.
+        """Write data to single page (256B on most chips) in SPI Flash.
         Page has to be erased before write is attempted.
         """
-        self.spi.spi_burst_new()
-        self.spi.spi_burst_write_int(self._WRITE_ENABLE)
-        self.spi.spi_burst_cs_reset()
-        self.spi.spi_burst_write_int(self._PAGE_PROGRAM)
-        self.spi.spi_burst_write_int(address, 3)
-        self.spi.spi_burst_write(data)
-        self.spi.spi_burst()
+        burst = self.spi.spi_burst_new()
+        self._burst_page(burst, address, data)
+        self.spi.spi_burst(burst)
         # Note: this is at maximum shorther than it takes us to check for busy
         # state (around 40ms). Because of that we use sleep here instead.
-        sleep(0.005)
+        sleep(self.program_tuning[1])
+
+    def write_pages(self, pages, callback=None, verify=False):
+        """Write multiple pages to SPI Flash. pages is list of tuples with
+        address and data of single page. Pages are grouped and every
+        group is programmed in single burst.
+        Pages have to be erased before write is attempted.
+        If verify is True then every page is read back in the same burst
+        right after it is programmed. Returns True if all pages were read back
+        correctly, False if not and None if verify is False.
+        """
+        result = True if verify else None
+        self.stats['pages_programmed'] += len(pages)
+        batch, program_time = self.program_tuning
+        if batch <= 1:
+            for i, (address, data) in enumerate(pages):
+                self.write_page(address, data)
+                if verify and not same(
+                        self.read_data(address, len(data)), data):
+                    result = False
+                if callback is not None:
+                    callback((i + 1) / len(pages))
+            return result
+
+        def _collect(group, pending):
+            response = self.spi.spi_collect(pending)
+            return not verify or \
+                response == b''.join(data for _, data in group)
+
+        # Burst of next group is submitted before previous one is collected
+        # so MPSSE does not wait while next burst is prepared.
+        opcode, dummy = self._read_command()
+        previous = None
+        for i in range(0, len(pages), batch):
+            group = pages[i:(i + batch)]
+            burst = self.spi.spi_burst_new()
+            for address, data in group:
+                self._burst_page(burst, address, data)
+                burst.delay(program_time)
+                if verify:
+                    burst.command(
+                        opcode, address, read=len(data), dummy=dummy)
+            pending = self.spi.spi_submit(burst)
+            if previous is not None:
+                if not _collect(*previous):
+                    result = False
+                if callback is not None:
+                    callback(i / len(pages))
+            previous = (group, pending)
+        if previous is not None:
+            if not _collect(*previous):
+                result = False
+            if callback is not None:
+                callback(1)
+        if pages:
+            # Note: bursts are only queued in MPSSE. Status read is queued
+            # after them so it also waits for the last one to finish.
+            self.busy_wait('page')
+        return result
 
     @staticmethod
     def _sectors_count(data_len, sector_size):
@@ -164,54 +474,389 @@ class SPIFlash():
         """Write given data from given address of memory. You should wipe
         target sector before calling this function. After wipe you can call
         this multiple times but only on non-overlapping sections."""
-        sectors = self._sectors_count(len(data), 0x100)
-        for i in range(sectors):
-            self.write_page(address + (256 * i), data[(256 * i):(256 * (i + 1))])
+        data = memoryview(data)  # Pages are sliced without copying
+        page = self.chip.page_size
+        self.write_pages([
+            (address + (page * i), data[(page * i):(page * (i + 1))])
+            for i in range(self._sectors_count(len(data), page))
+        ], callback)
+
+    def _plan(self, parts, indexes=None):
+        """Classify sectors and plan erase operations for given parts. parts is
+        list of tuples with address, current content and data sorted by
+        address. indexes is optional list of usable SectorIndex (or None) for
+        every part. Current content of parts with index is compared with it
+        instead of data. Returns tuple with list of sector classes for every
+        part and list of erase operations (see erase_plan)."""
+        if indexes is None:
+            indexes = [None] * len(parts)
+        program_time = self.program_tuning[1]
+        sector = self.chip.sector_size
+        page = self.chip.page_size
+        read_time = sector * 8 / self.spi.frequency
+        classes = []
+        owners = dict()  # Sector address to part content and offset
+        dirty = set()
+        for (address, current, data), index in zip(parts, indexes):
+            classes.append(
+                classify_sectors(current, data, sector) if index is None
+                else index.classify_sectors(current, data))
+            for i, sector_class in enumerate(classes[-1]):
+                owners[address + (i * sector)] = (
+                    current, data, index, i * sector)
+                if sector_class == SECTOR_ERASE:
+                    dirty.add(address + (i * sector))
+
+        def keep_cost(secaddr):
+            if secaddr not in owners:
+                # Outside of written range it has to be read and restored
+                return read_time + ((sector // page) * program_time)
+            # Pages that are already correct have to be programmed again
+            # unless they are blank
+            current, data, index, offset = owners[secaddr]
+            pages = range(offset, min(offset + sector, len(data)), page)
+            if index is not None:
+                return program_time * sum(
+                    1 for i in pages if i not in index.blank and
+                    index.same_page(i, current[i:(i + page)]))
+            blank = bytearray(b'\xff') * page
+            return program_time * sum(
+                1 for i in pages
+                if same(current[i:(i + page)], data[i:(i + page)]) and
+                not same(blank[:(len(data) - i)], data[i:(i + page)]))
+
+        start = parts[0][0]
+        end = max(address + len(data) for address, _, data in parts)
+        plan = plan_erase(
+            start, [secaddr in dirty for secaddr in range(start, end, sector)],
+            keep_cost, {
+                size: times[0]
+                for size, (_, times) in self.chip.erases.items()})
+        return classes, [
+            (self.chip.erases[size][0], addr, size) for addr, size in plan]
+
+    def erase_plan(self, address, current, data):
+        """Returns list of erase operations needed to write data to given
+        address when SPI Flash contains current content there. Sectors that
+        have to be erased are coalesced to 32KB and 64KB blocks if it is
+        expected to be faster. Every operation is tuple with opcode, address
+        and size of erased block."""
+        return self._plan([(address, current, data)])[1]
+
+    def _index(self, index, data):
+        "Returns given SectorIndex if it is usable for data and this chip"
+        if index is None or index.size != len(data) or \
+                not index.matches(self.chip.sector_size, self.chip.page_size):
+            return None
+        return index
+
+    def _program(self, parts, callback=None, verify=None, indexes=None,
+                 assumed=None):
+        """Erase and program given parts. parts is list of tuples with address,
+        current content and data sorted by address. callback is called with
+        index of part and progress of that part. verify is optional list of
+        booleans specifying parts that should be verified by reading back
+        programmed pages. Pages that were not programmed are verified against
+        content read before write. indexes is optional list of SectorIndex
+        (or None) for every part. assumed is optional list of booleans
+        specifying parts with current content that was assumed and not read.
+        All pages of such parts that were not programmed are read back if
+        they should be verified. Returns list with result of verification for
+        every part (None for parts that were not verified)."""
+        if verify is None:
+            verify = [False] * len(parts)
+        if indexes is None:
+            indexes = [None] * len(parts)
+        indexes = [
+            self._index(index, data)
+            for index, (_, _, data) in zip(indexes, parts)]
+        if assumed is None:
+            assumed = [False] * len(parts)
+        results = [True if value else None for value in verify]
+        classes, plan = self._plan(parts, indexes)
+        sector = self.chip.sector_size
+        page = self.chip.page_size
+        erased = set()
+        for _, eraddr, ersize in plan:
+            erased.update(range(eraddr, eraddr + ersize, sector))
+
+        def _owner(addr):
+            "Index of first part that ends after given address"
+            return next((
+                i for i, (address, _, data) in enumerate(parts)
+                if addr < address + len(data)), len(parts) - 1)
+
+        def _verified(index, result):
+            if verify[index] and not result:
+                results[index] = False
+
+        # Erase operations are accounted to part they start in or precede
+        work = [len(part_classes) for part_classes in classes]
+        for _, eraddr, _ in plan:
+            work[_owner(eraddr)] += 1
+        done = [0] * len(parts)
+
+        def _done(index):
+            done[index] += 1
             if callback is not None:
-                callback((i + 1) / sectors)
+                callback(index, done[index] / work[index])
+
+        # Backup sectors outside of parts that are erased as part of block
+        restore = {
+            secaddr: self.read_data(secaddr, sector) for secaddr in
+            sorted(erased) if not any(
+                address <= secaddr < address + len(data)
+                for address, _, data in parts)}
+        for _, eraddr, ersize in plan:
+            self._erase(ersize, eraddr)
+            _done(_owner(eraddr))
+        # Program pages. Pages with only erased value are skipped in erased
+        # sectors. In other sectors such page never differs as it would
+        # require erase. Pages of parts with index are compared with it.
+        for index, (address, current, data) in enumerate(parts):
+            sectors = indexes[index]
+            blank = blank_pages(data, page) if sectors is None else \
+                sectors.blank
+            programmed = set()  # Offsets of programmed pages
+            for i, sector_class in enumerate(classes[index]):
+                secaddr = address + (i * sector)
+                wipe = secaddr in erased
+                if sector_class != SECTOR_IDENTICAL or wipe:
+                    pages = []
+                    skipped = []
+                    for offset in range(
+                            i * sector, min((i + 1) * sector, len(data)),
+                            page):
+                        content = data[offset:(offset + page)]
+                        if wipe and offset in blank:
+                            skipped.append((address + offset, len(content)))
+                        elif wipe or not (
+                                same(current[offset:(offset + page)], content)
+                                if sectors is None else sectors.same_page(
+                                    offset, current[offset:(offset + page)])):
+                            pages.append((address + offset, content))
+                    self.stats['pages_blank'] += len(skipped)
+                    programmed.update(addr - address for addr, _ in pages)
+                    _verified(index, self.write_pages(
+                        pages, verify=verify[index]))
+                    if verify[index] and skipped and not assumed[index]:
+                        _verified(index, self._verify_blank(skipped))
+                _done(index)
+            if verify[index] and assumed[index]:
+                _verified(index, self._verify_pages(address, data, programmed))
+        # Restored sectors are accounted to part they were erased for
+        for secaddr, content in restore.items():
+            index = _owner(secaddr)
+            _verified(index, self.write_pages([
+                (secaddr + y, content[y:(y + page)])
+                for y in range(0, sector, page)
+                if content[y:(y + page)] != b'\xff' * page],
+                verify=verify[index]))
+        return results
+
+    def _verify_blank(self, pages):
+        """Check that given pages are erased. pages is list of tuples with
+        address and size sorted by address. Consecutive pages are read at
+        once."""
+        runs = []
+        for address, size in pages:
+            if runs and runs[-1][0] + runs[-1][1] == address:
+                runs[-1][1] += size
+            else:
+                runs.append([address, size])
+        return all(
+            self.read_data(address, size) == b'\xff' * size
+            for address, size in runs)
+
+    def _verify_pages(self, address, data, skip):
+        """Check that pages of data written to given address, except pages
+        with offset in skip, are in SPI Flash. Consecutive pages are read at
+        once."""
+        page = self.chip.page_size
+        runs = []
+        for offset in range(0, len(data), page):
+            if offset in skip:
+                continue
+            end = min(offset + page, len(data))
+            if runs and runs[-1][1] == offset:
+                runs[-1][1] = end
+            else:
+                runs.append([offset, end])
+        return all(
+            same(self.read_data(address + start, end - start),
+                 data[start:end])
+            for start, end in runs)
 
-    def write(self, address, data, callback=None):
+    def write(self, address, data, callback=None, verify=False,
+              blank_check=False, index=None):
         """Write data to given address. This method tries to be smart and does
-        as little as possible. It wipes memory at 4KB sectors and does that
-        only if data in memory does not match provided data."""
-        if address & 0xFFF != 0:  # Just to make this code simple
+        as little as possible. It erases only sectors where memory content
+        does not match provided data and it only programs pages that differ.
+        Sectors to be erased are coalesced to bigger blocks when it is faster
+        and content of other sectors in such block is restored.
+        If blank_check and verify are True and sampling shows that target
+        range is blank then it is programmed right away without reading it
+        first. Pages that were not programmed are then read back.
+        If verify is True then programmed pages are read back right after
+        program and result of this verification is returned. Otherwise None
+        is returned. Verification failure of range considered blank causes
+        write to be repeated without blank check.
+        data can be any bytes-like object. It is sliced without copying.
+        index is optional SectorIndex of data. Current content is compared
+        with it so data are accessed only in sectors that differ."""
+        if address % self.chip.sector_size != 0:  # To make this code simple
             raise MoxTesterSPIFLashUnalignedException(
-                "Write has to be aligned to 4KB sector")
+                "Write has to be aligned to sector")
+        data = memoryview(data)
         if callback is not None:
             callback(0)
-        size = len(data)
         # First read current state
-        current = self.read_data(
-            address, size, None if callback is None else
-            lambda p: callback(p * .2))
-        # Go trough 4K sectors (minimum size to erase)
-        secnum = self._sectors_count(size, 0x1000)
-        for i in range(secnum):
-            if callback is not None:
-                callback(.2 + .8 * (i / secnum))
-            secaddr = address + (i * 0x1000)
-            target = data[(i * 0x1000):((i + 1) * 0x1000)]
-            currsec = current[(i * 0x1000):((i + 1) * 0x1000)]
-            wipe = False
-            for y in range(len(target)):
-                wipe = wipe or ((currsec[y] ^ 0xff) & target[y])
-            if wipe:
-                self.sector_erase(secaddr)  # Erase only if it is required
-            for y in range(self._sectors_count(len(target), 0x100)):
-                page = target[(256 * y):(256 * (y + 1))]
-                if wipe or page != currsec[(256 * y):(256 * (y + 1))]:
-                    self.write_page(secaddr + (256 * y), page)
+        # Only read back can detect wrong sampling
+        blank = blank_check and verify and \
+            self.sample_blank(address, len(data))
+        if blank:
+            self.stats['regions_blank'] += 1
+            current = bytearray(b'\xff') * len(data)
+        else:
+            current = self.read_data(
+                address, len(data), None if callback is None else
+                lambda p: callback(p * .2))
+        result = self._program(
+            [(address, current, data)], None if callback is None else
+            lambda _, p: callback(.2 + .8 * p), [verify], [index],
+            [blank])[0]
+        if blank and result is False:
+            return self.write(address, data, callback, verify, False, index)
         if callback is not None:
             callback(1)
+        return result
+
+    def write_plan(self, regions, callback=None, cache=None,
+                   blank_check=True):
+        """Write all regions of given flash plan in single pass. Current content
+        of all regions is read first, then erase operations are planned for
+        all of them together, pages are programmed and at last regions are
+        verified according to their policy.
+        regions: sequence of FlashRegion
+        callback: optional function called with region name and its progress
+        cache: optional FlashCache. Regions that are recorded in it for this
+            chip as already written are only read and verified as a whole
+            without planning their write. Cache is updated with regions that
+            were successfully verified.
+        blank_check: if verified regions that sampling shows to be blank
+            should be programmed without reading them first. Pages of such
+            regions that were not programmed are read back. Such regions that
+            fail verification are written again without blank check. Regions
+            that are not verified are always read first.
+        Returns dictionary with region name as key and verification result as
+        value (None if region was not verified). Empty plan does nothing.
+        """
+        if not regions:
+            return dict()
+        # Data of regions are sliced without copying
+        regions = sorted((
+            region._replace(data=memoryview(region.data))
+            for region in regions), key=lambda region: region.address)
+        for region in regions:
+            if region.address % self.chip.sector_size != 0:
+                raise MoxTesterSPIFLashUnalignedException(
+                    "Region {} has to be aligned to sector".format(
+                        region.name))
+
+        def _progress(region, base, weight):
+            if callback is None:
+                return None
+            return lambda p: callback(region.name, base + (weight * p))
+
+        sector = self.chip.sector_size
+        unique_id = None if cache is None else self.unique_id()
+        cached = dict()
+        if unique_id is not None:
+            cached = cache.lookup(unique_id, sector)
+        indexes = [
+            self._index(region.index, region.data) for region in regions]
+        digests = {
+            region.name:
+            sector_digests(region.address, region.data, sector)
+            if index is None else index.sector_digests(region.address)
+            for region, index in zip(regions, indexes)}
+        parts = []
+        confirmed = set()  # Regions confirmed by cache and verification
+        blank = set()  # Regions considered blank by sampling
+        for region, index in zip(regions, indexes):
+            if cached and digests[region.name].items() <= cached.items():
+                if self.verify(region.address, region.data,
+                               _progress(region, 0, .2), index):
+                    confirmed.add(region.name)
+                    self.stats['regions_cached'] += 1
+                    parts.append((region.address, region.data, region.data))
+                    continue
+                cache.invalidate(unique_id)
+                cached = dict()
+            # Only read back can detect wrong sampling
+            if blank_check and region.verify != VERIFY_NONE and \
+                    self.sample_blank(region.address, len(region.data)):
+                blank.add(region.name)
+                self.stats['regions_blank'] += 1
+                parts.append((
+                    region.address, bytearray(b'\xff') * len(region.data),
+                    region.data))
+                continue
+            parts.append((region.address, self.read_data(
+                region.address, len(region.data),
+                _progress(region, 0, .2)), region.data))
+        readback = self._program(
+            parts, None if callback is None else
+            lambda i, p: callback(regions[i].name, .2 + (.6 * p)),
+            [region.verify == VERIFY_READBACK for region in regions], indexes,
+            [region.name in blank for region in regions])
+        results = dict()
+        for region, result, index in zip(regions, readback, indexes):
+            results[region.name] = result
+            if region.name in confirmed:
+                results[region.name] = True
+            elif region.verify == VERIFY_FULL:
+                results[region.name] = self.verify(
+                    region.address, region.data, _progress(region, .8, .2),
+                    index)
+            if callback is not None:
+                callback(region.name, 1)
+        retry = [
+            region for region in regions
+            if region.name in blank and results[region.name] is False]
+        if retry:
+            results.update(self.write_plan(retry, callback, None, False))
+        if unique_id is not None:
+            if False in results.values():
+                cache.invalidate(unique_id)
+            else:
+                verified = dict()
+                for region in regions:
+                    if results[region.name]:
+                        verified.update(digests[region.name])
+                cache.update(unique_id, sector, verified)
+        return results
 
-    def verify(self, address, data, callback=None):
+    def verify(self, address, data, callback=None, index=None):
         """Verify content of SPI Flash that from given address it contains
-        given data."""
-        current = self.read_data(
-            address, len(data), None if callback is None else
-            lambda progress: callback(progress * .95))
-        assert len(current) == len(data)
-        result = data == current
+        given data. If SectorIndex of data is provided then only digest of
+        read content is compared with it."""
+        progress = None if callback is None else \
+            lambda progress: callback(progress * .95)
+        if index is not None and index.size == len(data):
+            digest = hashlib.sha256()
+            for _ in self.read_stream(address, len(data), progress, None,
+                                      digest):
+                pass
+            result = digest.hexdigest() == index.digest
+        else:
+            expected = memoryview(data)
+            result = True
+            offset = 0
+            for chunk in self.read_stream(address, len(data), progress):
+                result = result and \
+                    chunk == expected[offset:(offset + len(chunk))]
+                offset = offset + len(chunk)
         if callback is not None:
             callback(1)
         return result
@@ -3,6 +3,7 @@ import traceback
 from gi.repository import GLib, Gtk
 from . import report
 from .moxtester import MoxTester
+from .moxtester.registry import REGISTRY
 from .moxtester.exceptions import MoxTesterException
 from .workflow import WorkFlow, WorkFlowHandler
 from .svgimage import SVGImage
@@ -51,6 +52,7 @@ class Programmer(WorkFlowHandler):
 
         self.workflow = None  # Current workflow for this programmer
         self.programmer = None  # Handle for MoxTester
+        self.board_present = None  # Last seen board presence (None if unknown)
         self.gtk_connect_programmer()
 
     def _obj(self, name):
@@ -67,7 +69,8 @@ class Programmer(WorkFlowHandler):
         Returns error string or None if selection was ok.
         """
         if self.programmer is None:
-            self.gtk_connect_programmer()  # First try to initialize it
+            # First try to initialize it (tester might have been plugged in)
+            self.gtk_connect_programmer(rescan=True)
             if self.programmer is None:
                 return "Programátor {} zřejmě není připojen".format(self.index + 1)
         if self.workflow is not None:
@@ -84,10 +87,12 @@ class Programmer(WorkFlowHandler):
         self._obj('BarcodeEntry').grab_focus()
         return None
 
-    def gtk_connect_programmer(self):
-        "Try to connect programmer"
+    def gtk_connect_programmer(self, rescan=False):
+        """Try to connect programmer. USB bus is enumerated again only if
+        rescan is True."""
         try:
-            self.programmer = MoxTester(self.index)
+            self.programmer = MoxTester(
+                self.index, self.conf.spi_frequency, rescan)
         except MoxTesterException:
             report.ignored_exception()
             self.gtk_disconnected_programmer()  # Ok this failed so we don't have programmer
@@ -99,12 +104,37 @@ class Programmer(WorkFlowHandler):
     def gtk_disconnected_programmer(self):
         "Set programmer as disconnected"
         self.programmer = None
+        self.board_present = None
         stack = self._obj("IntroStack")
         stack.set_visible_child(self._obj("IntroNotConnected"))
 
     def disconnected_programmer(self):
         GLib.idle_add(self.gtk_disconnected_programmer)
 
+    def gtk_monitor(self, connect=False):
+        """Periodic check of idle programmer. It tries to connect disconnected
+        tester if connect is True (bus was enumerated again) and updates board
+        presence of connected one. Programmer running workflow is not touched.
+        """
+        if self.workflow is not None:
+            return
+        if self.programmer is None:
+            if connect:
+                self.gtk_connect_programmer()
+            return
+        try:
+            present = self.programmer.board_present()
+        except MoxTesterException:
+            report.ignored_exception()
+            REGISTRY.forget(self.index)
+            self.gtk_disconnected_programmer()
+            return
+        if present != self.board_present:
+            self.board_present = present
+            self._obj("IntroPrepared").set_label(
+                "Programátor připraven\nDeska vložena" if present else
+                "Programátor připraven\nVložte desku")
+
     def gtks_barcode_entry(self, *udata):
         """Slot called when barcode is scanned to input box. Should check if
         given code is valid and start flashing process"""
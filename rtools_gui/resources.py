@@ -1,11 +1,16 @@
 import os
 import sys
+import mmap
 import stat
 import hashlib
 import socket
+import tempfile
 import subprocess
-from shutil import copyfile
+from shutil import copyfileobj
 import pexpect
+from .moxtester.flashcache import FlashCache
+from .moxtester.sectors import SectorIndex
+from .manifest import Manifest, git_inputs, git_state
 
 DIR_PREFIX = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
 SECURE_FIRMWARE = os.path.join(DIR_PREFIX, "firmware/secure-firmware")
@@ -17,53 +22,144 @@ MOX_IMAGER = os.path.join(MOX_IMAGER_DIR, "mox-imager")
 
 
 def _load_file(path):
+    "Map file to memory and return read-only memoryview of its content"
     with open(path, 'rb') as file:
-        data = file.read()
-    hsh = hashlib.sha256(data).hexdigest()
-    return data, hsh
+        if os.fstat(file.fileno()).st_size == 0:
+            return memoryview(b'')  # Empty file can't be mapped
+        return memoryview(
+            mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ))
+
+
+def _hash(data):
+    return hashlib.sha256(data).hexdigest()
 
 
 def _git_head_hash(path):
-    curdir = os.getcwd()
-    os.chdir(path)
     process = subprocess.run(
         ['git', 'describe', '--long', '--always', '--dirty'],
-        stdout=subprocess.PIPE)
-    githash = process.stdout.decode(sys.getdefaultencoding()).strip()
-    os.chdir(curdir)
-    return githash
+        stdout=subprocess.PIPE, cwd=path)
+    return process.stdout.decode(sys.getdefaultencoding()).strip()
+
+
+def _manifest_inputs():
+    "Files values stored in manifest are computed from"
+    return [SECURE_FIRMWARE, UBOOT, RESCUE, DTB, MOX_IMAGER] + \
+        git_inputs(DIR_PREFIX) + git_inputs(MOX_IMAGER_DIR)
 
 
 class Resources:
     "Resources used by rtools-gui"
 
     def __init__(self, conf):
-        self.__secure_firmware, self.__secure_firmware_hash = _load_file(SECURE_FIRMWARE)
-        self.__uboot, self.__uboot_hash = _load_file(UBOOT)
-        self.__rescue, self.__rescue_hash = _load_file(RESCUE)
-        self.__dtb, self.__dtb_hash = _load_file(DTB)
+        self.__secure_firmware = _load_file(SECURE_FIRMWARE)
+        self.__uboot = _load_file(UBOOT)
+        self.__rescue = _load_file(RESCUE)
+        self.__dtb = _load_file(DTB)
         self.__hostname = socket.gethostname()
-        self.__rtools_git = _git_head_hash(DIR_PREFIX)
-        self.__mox_imager_git = _git_head_hash(MOX_IMAGER_DIR)
-
+        self.__flash_cache = FlashCache(
+            os.path.join(conf.cache_dir, 'spiflash'))
+        if conf.clear_flash_cache:
+            self.__flash_cache.clear()
+
+        # Values that are expensive to compute are cached in manifest
+        manifest = Manifest(os.path.join(conf.cache_dir, 'manifest.json'))
+        # State of repositories is part of parameters as git describe
+        # reports any change of tracked files.
+        params = {
+            'tmp_dir': conf.tmp_dir,
+            'rtools_git': git_state(DIR_PREFIX),
+            'mox_imager_git': git_state(MOX_IMAGER_DIR),
+        }
+        values = manifest.load(_manifest_inputs(), params)
+        if values is None:
+            values = self._compute(conf)
+            manifest.save(_manifest_inputs(), params, values)
+        elif not self._staged(
+                values['mox_imager_exec'], values['mox_imager_hash']):
+            self._stage(values['mox_imager_exec'])
+        self.__secure_firmware_hash = values['secure_firmware_hash']
+        self.__uboot_hash = values['uboot_hash']
+        self.__rescue_hash = values['rescue_hash']
+        self.__dtb_hash = values['dtb_hash']
+        self.__rtools_git = values['rtools_git']
+        self.__mox_imager_git = values['mox_imager_git']
+        self.__mox_imager_hash = values['mox_imager_hash']
+        self.__mox_imager_exec = values['mox_imager_exec']
+        self.__mox_imager_secure_firmware_hash = \
+            values['mox_imager_secure_firmware_hash']
+
+        # Sector indexes of images are cached in their own manifest as they
+        # depend only on images.
+        manifest = Manifest(os.path.join(conf.cache_dir, 'sectorindex.json'))
+        inputs = [SECURE_FIRMWARE, UBOOT, RESCUE, DTB]
+        geometry = {'sector_size': 0x1000, 'page_size': 256}
+        params = dict(geometry, version=SectorIndex.VERSION)
+        values = manifest.load(inputs, params)
+        if values is None:
+            values = {
+                name: SectorIndex.build(data, **geometry).to_dict()
+                for name, data in (
+                    ('secure_firmware', self.__secure_firmware),
+                    ('uboot', self.__uboot),
+                    ('rescue', self.__rescue),
+                    ('dtb', self.__dtb))}
+            manifest.save(inputs, params, values)
+        self.__secure_firmware_index = SectorIndex.from_dict(
+            values['secure_firmware'])
+        self.__uboot_index = SectorIndex.from_dict(values['uboot'])
+        self.__rescue_index = SectorIndex.from_dict(values['rescue'])
+        self.__dtb_index = SectorIndex.from_dict(values['dtb'])
+
+    @staticmethod
+    def _staged(path, mox_imager_hash):
+        """Check if staged copy of mox-imager is still in place and it was not
+        modified since it was staged"""
+        if not os.access(path, os.X_OK):
+            return False
+        with open(path, 'rb') as file:
+            return _hash(file.read()) == mox_imager_hash
+
+    @staticmethod
+    def _stage(path):
+        """Copy mox-imager to given path. It is copied to temporary file first
+        and then moved so file that is already on path is replaced and not
+        written to."""
+        staging = tempfile.NamedTemporaryFile(
+            dir=os.path.dirname(path), prefix='.rtools-mox-imager-',
+            delete=False)
+        with staging, open(MOX_IMAGER, 'rb') as source:
+            copyfileobj(source, staging)
+        os.chmod(staging.name, os.stat(staging.name).st_mode | stat.S_IEXEC)
+        os.replace(staging.name, path)
+
+    def _compute(self, conf):
+        "Compute values stored in manifest"
+        values = {
+            'secure_firmware_hash': _hash(self.__secure_firmware),
+            'uboot_hash': _hash(self.__uboot),
+            'rescue_hash': _hash(self.__rescue),
+            'dtb_hash': _hash(self.__dtb),
+            'rtools_git': _git_head_hash(DIR_PREFIX),
+            'mox_imager_git': _git_head_hash(MOX_IMAGER_DIR),
+        }
         # Mox imager
         # TODO exception when there is no executable
-        with open(MOX_IMAGER, 'rb') as file:
-            self.__mox_imager_hash = hashlib.sha256(file.read()).hexdigest()
-        self.__mox_imager_exec = os.path.join(
-            conf.tmp_dir, 'rtools-mox-imager-' + self.__mox_imager_hash)
-        copyfile(MOX_IMAGER, self.__mox_imager_exec)
-        os.chmod(self.__mox_imager_exec,
-                 os.stat(self.__mox_imager_exec).st_mode | stat.S_IEXEC)
+        values['mox_imager_hash'] = _hash(_load_file(MOX_IMAGER))
+        mox_imager_exec = os.path.join(
+            conf.tmp_dir, 'rtools-mox-imager-' + values['mox_imager_hash'])
+        self._stage(mox_imager_exec)
+        values['mox_imager_exec'] = mox_imager_exec
         # Hash for moximager
-        with pexpect.spawn(self.mox_imager_exec, ['--get-otp-hash', SECURE_FIRMWARE]) as pexp:
+        with pexpect.spawn(mox_imager_exec, ['--get-otp-hash', SECURE_FIRMWARE]) as pexp:
             pexp.expect(['Secure firmware OTP hash: '])
             pexp.expect([r'\S{64}'])
-            self.__mox_imager_secure_firmware_hash = pexp.after.decode(sys.getdefaultencoding())
+            values['mox_imager_secure_firmware_hash'] = \
+                pexp.after.decode(sys.getdefaultencoding())
+        return values
 
     @property
     def secure_firmware(self):
-        "Bytes of secure firmware"
+        "Read-only memoryview of secure firmware (mapped file)"
         return self.__secure_firmware
 
     @property
@@ -71,9 +167,14 @@ class Resources:
         "Sha256 hash of secure firmware"
         return self.__secure_firmware_hash
 
+    @property
+    def secure_firmware_index(self):
+        "SectorIndex of secure firmware"
+        return self.__secure_firmware_index
+
     @property
     def uboot(self):
-        "Bytes of u-boot image"
+        "Read-only memoryview of u-boot image (mapped file)"
         return self.__uboot
 
     @property
@@ -81,9 +182,14 @@ class Resources:
         "Sha256 hash of u-boot image"
         return self.__uboot_hash
 
+    @property
+    def uboot_index(self):
+        "SectorIndex of u-boot image"
+        return self.__uboot_index
+
     @property
     def rescue(self):
-        "Bytes of rescue image"
+        "Read-only memoryview of rescue image (mapped file)"
         return self.__rescue
 
     @property
@@ -91,9 +197,14 @@ class Resources:
         "Sha256 hash of rescue image"
         return self.__rescue_hash
 
+    @property
+    def rescue_index(self):
+        "SectorIndex of rescue image"
+        return self.__rescue_index
+
     @property
     def dtb(self):
-        "Bytes of device tree"
+        "Read-only memoryview of device tree (mapped file)"
         return self.__dtb
 
     @property
@@ -101,6 +212,16 @@ class Resources:
         "Sha256 hash of device tree"
         return self.__dtb_hash
 
+    @property
+    def dtb_index(self):
+        "SectorIndex of device tree"
+        return self.__dtb_index
+
+    @property
+    def flash_cache(self):
+        "Cache of SPI Flash content of boards programmed on this station"
+        return self.__flash_cache
+
     @property
     def hostname(self):
         "Hostname of machine programmator is running on"
@@ -1,3 +1,4 @@
+import os
 from threading import Thread
 from .. import db, report
 from .exceptions import InvalidBoardNumberException
@@ -92,9 +93,10 @@ class WorkFlow:
         self.db_board = db.Board(db_connection, serial_number)
 
         # Load steps
+        shared = dict()
         self.steps = [
             step(serial_number, moxtester, conf, resources, self.db_board,
-                 handler.progress_step) for step in
+                 handler.progress_step, shared) for step in
             _BOARD_MAP[self.board_id]['steps']]
         # Create thread
         self.thread = Thread(
@@ -133,6 +135,14 @@ class WorkFlow:
         db_run = db.ProgrammerRun(
             self.db_connection, self.db_board, self.db_programmer_state,
             self.moxtester.tester_id, [x.id() for x in self.steps])
+        transcript = os.path.join(
+            self.conf.transcript_dir,
+            '{}-{}.log.gz'.format(db_run.id, hex(self.serial_number)))
+        try:
+            self.moxtester.uart_capture.start(transcript)
+        except OSError:
+            report.ignored_exception()
+            transcript = None
         error_str = None
         for step in self.steps:
             db_step = db.ProgrammerStep(
@@ -156,6 +166,10 @@ class WorkFlow:
                 break  # Do not continue after exception in workflow
         self.moxtester.default()  # Return moxtester to default safe setting
         db_run.finish(error_str is None)
+        if transcript is not None:
+            stats = self.moxtester.uart_capture.stop()
+            db_run.transcript(
+                transcript, stats['rx'], stats['tx'], stats['dropped'])
         report.log("Workflow ended on programmer {} for board {}".format(
             self.moxtester.tester_id, hex(self.serial_number)))
         self.handler.workflow_exit(None if error_str is None else error_str)
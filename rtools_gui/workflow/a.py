@@ -6,6 +6,7 @@ from .generic import Step
 from .exceptions import FatalWorkflowException
 from .. import report
 from ..moxtester.exceptions import MoxTesterImagerNoBootPrompt
+from ..moxtester.spiflash import FlashRegion, VERIFY_READBACK
 
 
 class OTPProgramming(Step):
@@ -43,22 +44,86 @@ class OTPProgramming(Step):
 
 
 class SPIFlashStep(Step):
-    "Generic SPI Flash programming step"
+    """Generic SPI Flash programming step. All regions of SPI Flash are
+    written in single session by first of these steps. Results are shared with
+    other steps so every one of them reports result of its own region. Step
+    that writes regions reports combined progress of all of them as reported
+    per region by SPIFlash.write_plan."""
+
+    def _plan(self):
+        "Returns flash plan for all SPI Flash regions"
+        return [
+            FlashRegion(step.id(), step.address(), step.binary(self.resources),
+                        VERIFY_READBACK, step.index(self.resources))
+            for step in ASTEPS if issubclass(step, SPIFlashStep)]
+
+    def _flash(self):
+        plan = self._plan()
+        total = sum(len(region.data) for region in plan) or 1
+        progress = {region.name: 0 for region in plan}
+
+        def _progress(name, value):
+            progress[name] = value
+            self.set_progress(sum(
+                progress[region.name] * len(region.data)
+                for region in plan) / total)
 
-    def _flash(self, binary, address):
         self.set_progress(0)
         with self.moxtester.spiflash() as flash:
             flash.reset_device()
-            flash.write(address, binary, lambda v: self.set_progress(.8 * v))
-            if not flash.verify(address, binary, lambda v: self.set_progress(.8 + (.2 * v))):
-                raise FatalWorkflowException("SPI content verification failed")
+            cache = self.resources.flash_cache
+            results = flash.write_plan(plan, _progress, cache)
+            # Single retry with safe clock
+            if False in results.values() and flash.fallback():
+                report.log("SPI Flash verification failed on programmer {}, falling back to {} kHz".format(
+                    self.moxtester.tester_id, flash.spi.frequency // 1000))
+                results = flash.write_plan(plan, _progress, cache)
+            report.log("SPI Flash ({}) on programmer {} for board {} written with {} kHz clock".format(
+                flash.chip.name, self.moxtester.tester_id, hex(self.serial_number),
+                flash.spi.frequency // 1000))
+            report.log("SPI Flash on programmer {} for board {}: {} pages programmed, {} blank pages skipped, {} regions cached, {} regions blank".format(
+                self.moxtester.tester_id, hex(self.serial_number),
+                flash.stats['pages_programmed'], flash.stats['pages_blank'],
+                flash.stats['regions_cached'], flash.stats['regions_blank']))
+            return results
+
+    def run(self):
+        if 'spiflash' not in self.shared:
+            self.shared['spiflash'] = self._flash()
+        self.set_progress(1)
+        if not self.shared['spiflash'][self.id()]:
+            raise FatalWorkflowException("SPI content verification failed")
+
+    @staticmethod
+    def address():
+        "Address of region in SPI Flash this step writes"
+        raise NotImplementedError()
+
+    @staticmethod
+    def binary(resources):
+        "Returns data to be written to region of this step"
+        raise NotImplementedError()
+
+    @staticmethod
+    def index(resources):
+        "Returns SectorIndex of data of this step (or None)"
+        return None
 
 
 class ProgramSecureFirmware(SPIFlashStep):
     "Program secure firmware to SPI flash memory"
 
-    def run(self):
-        self._flash(self.resources.secure_firmware, 0x0)
+    @staticmethod
+    def address():
+        return 0x0
+
+    @staticmethod
+    def binary(resources):
+        return resources.secure_firmware
+
+    @staticmethod
+    def index(resources):
+        return resources.secure_firmware_index
 
     @staticmethod
     def name():
@@ -72,8 +137,17 @@ class ProgramSecureFirmware(SPIFlashStep):
 class ProgramUBoot(SPIFlashStep):
     "Program u-boot to SPI flash memory"
 
-    def run(self):
-        self._flash(self.resources.uboot, 0x20000)
+    @staticmethod
+    def address():
+        return 0x20000
+
+    @staticmethod
+    def binary(resources):
+        return resources.uboot
+
+    @staticmethod
+    def index(resources):
+        return resources.uboot_index
 
     @staticmethod
     def name():
@@ -87,8 +161,17 @@ class ProgramUBoot(SPIFlashStep):
 class ProgramRescue(SPIFlashStep):
     "Program rescue to SPI flash memory"
 
-    def run(self):
-        self._flash(self.resources.rescue, 0x190000)
+    @staticmethod
+    def address():
+        return 0x190000
+
+    @staticmethod
+    def binary(resources):
+        return resources.rescue
+
+    @staticmethod
+    def index(resources):
+        return resources.rescue_index
 
     @staticmethod
     def name():
@@ -102,8 +185,17 @@ class ProgramRescue(SPIFlashStep):
 class ProgramDTB(SPIFlashStep):
     "Program DTB to SPI flash memory"
 
-    def run(self):
-        self._flash(self.resources.dtb, 0x7f0000)
+    @staticmethod
+    def address():
+        return 0x7f0000
+
+    @staticmethod
+    def binary(resources):
+        return resources.dtb
+
+    @staticmethod
+    def index(resources):
+        return resources.dtb_index
 
     @staticmethod
     def name():
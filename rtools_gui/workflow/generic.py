@@ -4,13 +4,14 @@ from .exceptions import FatalWorkflowException
 class Step:
     "Abstract class for signle step"
 
-    def __init__(self, serial_number, moxtester, conf, resources, db_board, set_progress):
+    def __init__(self, serial_number, moxtester, conf, resources, db_board, set_progress, shared):
         self.serial_number = serial_number
         self.moxtester = moxtester
         self.conf = conf
         self.resources = resources
         self.db_board = db_board
         self.set_progress = set_progress
+        self.shared = shared  # Dictionary shared by all steps of workflow
 
     def run(self):
         "Run this step"
@@ -64,6 +64,17 @@ CREATE TABLE run_results (
 );
 COMMENT ON COLUMN run_results.success IS 'If run reached last step without error or warning';
 
+CREATE TABLE run_transcripts (
+	id bigint PRIMARY KEY REFERENCES runs (id),
+	path text NOT NULL,
+	rx_bytes integer NOT NULL,
+	tx_bytes integer NOT NULL,
+	dropped integer NOT NULL,
+	add_time timestamp NOT NULL DEFAULT current_timestamp
+);
+COMMENT ON COLUMN run_transcripts.path IS 'Path to gzip compressed UART transcript on programmer';
+COMMENT ON COLUMN run_transcripts.dropped IS 'Number of UART data chunks missing in transcript';
+
 CREATE TABLE steps (
 	id bigserial PRIMARY KEY,
 	step_name text NOT NULL,
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+import os
+import time
+import argparse
+import timeit
+# Flash benchmarks run on emulated tester unless RTOOLS_FTDI_EMULATOR is
+# explicitly set to empty value.
+os.environ.setdefault('RTOOLS_FTDI_EMULATOR', '1')
+from rtools_gui.moxtester import MoxTester
+from rtools_gui.moxtester.backend import ftdi
+from rtools_gui.moxtester.sectors import classify_sectors, SECTOR_IDENTICAL
+from rtools_gui.moxtester.sectors import SECTOR_PROGRAM, SECTOR_ERASE
+
+UBOOT = os.path.join(
+    os.path.dirname(os.path.realpath(__file__)), "firmware/u-boot")
+
+
+def classify_bytewise(current, target):
+    "Original per byte sectors classification used as a reference"
+    classes = []
+    for i in range(0, len(target), 0x1000):
+        tsec = target[i:(i + 0x1000)]
+        csec = current[i:(i + 0x1000)]
+        wipe = False
+        for y in range(len(tsec)):
+            wipe = wipe or ((csec[y] ^ 0xff) & tsec[y])
+        if wipe:
+            classes.append(SECTOR_ERASE)
+        elif tsec != csec:
+            classes.append(SECTOR_PROGRAM)
+        else:
+            classes.append(SECTOR_IDENTICAL)
+    return classes
+
+
+def bench_classify(options):
+    "Benchmark of sectors classification used in SPIFlash.write"
+    with open(UBOOT, 'rb') as file:
+        target = file.read()
+    currents = {
+        'blank': b'\xff' * len(target),
+        'identical': bytes(target),
+        'program': bytes(byte | 0x01 for byte in target),
+        'erase': bytes(len(target)),
+    }
+    print("Classification of {} KiB (u-boot)".format(len(target) // 1024))
+    for name, current in currents.items():
+        expected = classify_bytewise(current, target)
+        if classify_sectors(current, target) != expected:
+            exit("Classification mismatch for: " + name)
+        for impl in (classify_bytewise, classify_sectors):
+            seconds = min(timeit.repeat(
+                lambda: impl(current, target), number=1,
+                repeat=options.repeat))
+            print("{:10} {:18} {:10.3f} ms {:10.1f} MB/s".format(
+                name, impl.__name__, seconds * 1000,
+                len(target) / seconds / 1000000))
+
+
+def _usb_transactions(options):
+    "Number of USB transactions on SPI interface (only for emulator)"
+    if not hasattr(ftdi, 'DEVICES'):
+        return None
+    iface = ftdi.DEVICES[options.id].interfaces[ftdi.INTERFACE_B]
+    return iface.writes + iface.reads
+
+
+def _measure(options, name, size, function):
+    "Run function repeatedly and print the best result"
+    best = None
+    for _ in range(options.repeat):
+        transactions = _usb_transactions(options)
+        start = time.perf_counter()
+        cpu_start = time.process_time()
+        function()
+        result = (
+            time.perf_counter() - start, time.process_time() - cpu_start,
+            None if transactions is None else
+            _usb_transactions(options) - transactions)
+        if best is None or result[0] < best[0]:
+            best = result
+    seconds, cpu, transactions = best
+    print("{:8} {:10.3f} s {:8.3f} MB/s {:>10} trans/MB {:8.3f} s CPU".format(
+        name, seconds, size / seconds / 1000000,
+        '-' if transactions is None else
+        "{:.1f}".format(transactions / (size / 1000000)), cpu))
+
+
+def _check_written(options, flash, address, image):
+    "Exit if image is not in SPI Flash on given address"
+    if not flash.verify(address, image):
+        exit("Written image verification failed")
+    if hasattr(ftdi, 'DEVICES'):
+        flash_data = ftdi.DEVICES[options.id].flash.data
+        if flash_data[address:(address + len(image))] != image:
+            exit("Emulated SPI Flash does not contain written image")
+
+
+def bench_flash(options):
+    """Benchmark of SPIFlash operations. Note that with emulator CPU time
+    includes emulation itself."""
+    with open(UBOOT, 'rb') as file:
+        image = file.read()
+    address = 0x100000
+    mxt = MoxTester(options.id)
+    with mxt.spiflash() as flash:
+        print("SPI Flash {} at {} kHz, image of {} KiB (u-boot)".format(
+            flash.chip.name, flash.spi.frequency // 1000, len(image) // 1024))
+        if options.benchmark in ('flash', 'read'):
+            _measure(options, 'read', len(image),
+                     lambda: flash.read_data(address, len(image)))
+        if options.benchmark in ('flash', 'write'):
+            def _write():
+                if hasattr(ftdi, 'DEVICES'):
+                    # Start from content that requires erase every time
+                    flash_data = ftdi.DEVICES[options.id].flash.data
+                    flash_data[address:(address + len(image))] = \
+                        bytes(len(image))
+                flash.write(address, image)
+            _measure(options, 'write', len(image), _write)
+            _check_written(options, flash, address, image)
+        if options.benchmark in ('flash', 'verify'):
+            flash.write(address, image)
+            _check_written(options, flash, address, image)
+            _measure(options, 'verify', len(image),
+                     lambda: flash.verify(address, image) or
+                     exit("Image verification failed"))
+        if options.benchmark in ('flash', 'erase'):
+            _measure(options, 'erase', flash.chip.size or len(image),
+                     flash.chip_erase)
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="spiflash_benchmark")
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Number of repetitions of every measurement')
+    parser.add_argument('--id', type=int, default=0,
+                        help='Identifier of tester used by flash benchmarks')
+    parser.add_argument(
+        'benchmark', nargs='?', default='classify',
+        choices=('classify', 'flash', 'read', 'write', 'verify', 'erase'),
+        help='Benchmark to run (flash runs all SPIFlash benchmarks)')
+    options = parser.parse_args()
+
+    if options.benchmark == 'classify':
+        bench_classify(options)
+    else:
+        bench_flash(options)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""Regression tests of SPIFlash write operations on emulated tester. Run
+either directly or by pytest."""
+import os
+import tempfile
+import unittest
+# Tests always run on emulated tester
+os.environ['RTOOLS_FTDI_EMULATOR'] = '1'
+from rtools_gui.moxtester import MoxTester
+from rtools_gui.moxtester.backend import ftdi
+from rtools_gui.moxtester.flashcache import FlashCache
+from rtools_gui.moxtester.spiflash import FlashRegion
+from rtools_gui.moxtester.spiflash import VERIFY_NONE, VERIFY_FULL
+from rtools_gui.moxtester.spiflash import VERIFY_READBACK
+
+TESTER = 1
+ADDRESS = 0x100000
+# Image with varying, blank and partial last page content
+IMAGE = bytes(range(256)) * 16 + b'\xff' * 0x1000 + b'\x5a' * 0x1080
+
+
+class SPIFlashWriteTest(unittest.TestCase):
+    "SPIFlash.write and SPIFlash.write_plan"
+
+    @classmethod
+    def setUpClass(cls):
+        cls.moxtester = MoxTester(TESTER)
+        cls.data = ftdi.DEVICES[TESTER].flash.data
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.moxtester.disconnect_tester()
+
+    def fill(self, address, content):
+        "Set content of emulated SPI Flash"
+        self.data[address:(address + len(content))] = content
+
+    def assertFlash(self, address, content):
+        "Check content of emulated SPI Flash"
+        self.assertEqual(
+            bytes(self.data[address:(address + len(content))]), content)
+
+    def test_write(self):
+        self.fill(ADDRESS, bytes(len(IMAGE)))
+        with self.moxtester.spiflash() as flash:
+            self.assertIs(flash.write(ADDRESS, IMAGE, verify=True), True)
+            self.assertIs(flash.verify(ADDRESS, IMAGE), True)
+        self.assertFlash(ADDRESS, IMAGE)
+
+    def test_write_blank_check_stale(self):
+        # Sector looks blank by its start but holds old data under blank page
+        self.fill(ADDRESS, b'\xff' * len(IMAGE))
+        self.fill(ADDRESS + 0x1100, bytes(0x100))
+        with self.moxtester.spiflash() as flash:
+            self.assertIs(flash.write(
+                ADDRESS, IMAGE, verify=True, blank_check=True), True)
+        self.assertFlash(ADDRESS, IMAGE)
+
+    def test_write_blank_check_no_verify(self):
+        self.fill(ADDRESS, b'\xff' * len(IMAGE))
+        self.fill(ADDRESS + 0x1100, bytes(0x100))
+        with self.moxtester.spiflash() as flash:
+            self.assertIsNone(flash.write(ADDRESS, IMAGE, blank_check=True))
+        self.assertFlash(ADDRESS, IMAGE)
+
+    def test_write_plan_blank_check_stale(self):
+        regions = [
+            FlashRegion('readback', ADDRESS, IMAGE, VERIFY_READBACK),
+            FlashRegion('none', ADDRESS + 0x10000, IMAGE, VERIFY_NONE),
+        ]
+        for region in regions:
+            self.fill(region.address, b'\xff' * len(IMAGE))
+            self.fill(region.address + 0x1100, bytes(0x100))
+        with self.moxtester.spiflash() as flash:
+            self.assertEqual(flash.write_plan(regions, blank_check=True), {
+                'readback': True, 'none': None})
+        for region in regions:
+            self.assertFlash(region.address, IMAGE)
+
+    def test_write_plan(self):
+        regions = [
+            FlashRegion('readback', ADDRESS, IMAGE, VERIFY_READBACK),
+            FlashRegion('full', ADDRESS + 0x10000, IMAGE, VERIFY_FULL),
+            FlashRegion('none', ADDRESS + 0x20000, IMAGE, VERIFY_NONE),
+        ]
+        for region in regions:
+            self.fill(region.address, bytes(len(IMAGE)))
+        with self.moxtester.spiflash() as flash:
+            self.assertEqual(flash.write_plan(regions), {
+                'readback': True, 'full': True, 'none': None})
+        for region in regions:
+            self.assertFlash(region.address, IMAGE)
+
+    def test_write_plan_cache(self):
+        regions = [FlashRegion('cached', ADDRESS, IMAGE, VERIFY_READBACK)]
+        self.fill(ADDRESS, bytes(len(IMAGE)))
+        with tempfile.TemporaryDirectory() as directory:
+            cache = FlashCache(directory)
+            with self.moxtester.spiflash() as flash:
+                self.assertEqual(
+                    flash.write_plan(regions, cache=cache), {'cached': True})
+                # Any modified sector has to be found despite cache hit
+                self.fill(ADDRESS + 0x2000, bytes(0x1000))
+                self.assertEqual(
+                    flash.write_plan(regions, cache=cache), {'cached': True})
+                self.assertEqual(flash.stats['regions_cached'], 0)
+                self.assertEqual(
+                    flash.write_plan(regions, cache=cache), {'cached': True})
+                self.assertEqual(flash.stats['regions_cached'], 1)
+        self.assertFlash(ADDRESS, IMAGE)
+
+    def test_write_plan_empty(self):
+        with self.moxtester.spiflash() as flash:
+            self.assertEqual(flash.write_plan([]), {})
+
+
+if __name__ == '__main__':
+    unittest.main()